@@ -0,0 +1,63 @@
+"""Compare the aligned-array summary exporter against the original per-distance lookup loop.
+
+Usage: python benchmarks/bench_export.py [file.txt ...]
+Without arguments the synthetic experiment from bench_ingest.py is used.
+"""
+import filecmp
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from diffusion_analysis.data import load_experiment  # noqa: E402
+from diffusion_analysis.summary import PARQUET_AVAILABLE, summary_table, SUMMARY_WRITERS  # noqa: E402
+from bench_ingest import best_of, legacy_process_files, write_synthetic  # noqa: E402
+
+
+def legacy_export_txt(time_groups, file_path):
+    # The export_last_data_as_txt loop before the aligned-array writer
+    with open(file_path, 'w') as f:
+        f.write("# Exported Fluorescence Data (Mean ± Std)\n")
+        f.write("# Time(h)\tDistance(um)\tRawMean\tRawStd\tNormMean\tNormStd\n")
+        for t in sorted(time_groups.keys()):
+            group = time_groups[t]
+            all_distances = sorted(set(d for rep in group for d in rep['distance']))
+            for d in all_distances:
+                raw_vals = []
+                norm_vals = []
+                for rep in group:
+                    if d in rep['distance']:
+                        idx = rep['distance'].index(d)
+                        raw_vals.append(rep['raw'][idx])
+                        norm_vals.append(rep['normalized'][idx])
+                if raw_vals and norm_vals:
+                    m_r = np.mean(raw_vals)
+                    s_r = np.std(raw_vals, ddof=1) if len(raw_vals) > 1 else 0
+                    m_n = np.mean(norm_vals)
+                    s_n = np.std(norm_vals, ddof=1) if len(norm_vals) > 1 else 0
+                    f.write(f"{t:.2f}\t{d:.1f}\t{m_r:.6f}\t{s_r:.6f}\t{m_n:.6f}\t{s_n:.6f}\n")
+
+
+def main(paths, out_dir):
+    groups = legacy_process_files(paths)
+    exp = load_experiment(paths)
+    legacy_path = os.path.join(out_dir, 'legacy.txt')
+    t_legacy, _ = best_of(lambda: legacy_export_txt(groups, legacy_path), repeat=1)
+    print(f"files: {len(paths)}  shape: {exp.raw.shape}")
+    print(f"legacy .txt : {t_legacy*1000:9.1f} ms")
+    t_table, table = best_of(lambda: summary_table(exp))
+    print(f"stats table : {t_table*1000:9.1f} ms")
+    for ext, writer in SUMMARY_WRITERS.items():
+        if ext == '.parquet' and not PARQUET_AVAILABLE:
+            continue
+        path = os.path.join(out_dir, 'summary' + ext)
+        t, _ = best_of(lambda: writer(exp, path, table))
+        print(f"writer {ext:8s}: {t*1000:9.1f} ms  {os.path.getsize(path)/1e6:8.2f} MB")
+    assert filecmp.cmp(legacy_path, os.path.join(out_dir, 'summary.txt'), shallow=False), "TXT output differs"
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmp:
+        main(sys.argv[1:] or write_synthetic(tmp), tmp)
@@ -0,0 +1,82 @@
+"""Compare the vectorized loader against the original per-line parsing loop.
+
+Usage: python benchmarks/bench_ingest.py [file.txt ...]
+Without arguments a synthetic experiment (1000 positions x 41 timepoints x 24 replicates) is written to a
+temporary directory and loaded.
+"""
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from diffusion_analysis.data import load_experiment  # noqa: E402
+
+
+def legacy_process_files(file_paths, time_interval=0.25):
+    # The loop process_files used before the array loader
+    time_groups = {}
+    for file_path in file_paths:
+        with open(file_path, 'r') as file:
+            content = file.read().strip()
+            blocks = [b.strip() for b in content.split('\n') if b.strip()]
+            for idx, block in enumerate(blocks):
+                values = list(map(float, block.split(',')))
+                source = np.mean(values[:5])
+                sink = np.mean(values[-5:])
+                normalized = [(x - sink)/(source - sink)*100 for x in values]
+                hours = idx * time_interval
+                time_groups.setdefault(hours, []).append({
+                    'distance': [i*10 for i in range(len(values))],
+                    'raw': values,
+                    'normalized': normalized,
+                    'source': source,
+                    'sink': sink
+                })
+    return time_groups
+
+
+def write_synthetic(directory, n_replicates=24, n_times=41, n_positions=1000, seed=0):
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 1, n_positions)
+    paths = []
+    for r in range(n_replicates):
+        front = np.linspace(0.05, 0.6, n_times)[:, None]
+        profile = 10000 / (1 + np.exp((x[None, :] - front) / 0.05)) + 700
+        profile += rng.normal(0, 50, profile.shape)
+        path = os.path.join(directory, f"synthetic_{r}.txt")
+        np.savetxt(path, np.round(profile), fmt='%d', delimiter=',')
+        paths.append(path)
+    return paths
+
+
+def best_of(func, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        result = None  # release the previous result before the next run
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main(paths):
+    t_legacy, groups = best_of(lambda: legacy_process_files(paths))
+    t_new, exp = best_of(lambda: load_experiment(paths))
+    for ti, t in enumerate(exp.times):
+        for r, rep in enumerate(groups.get(t, [])):
+            assert np.allclose(rep['raw'], exp.raw[r, ti])
+            assert np.allclose(rep['normalized'], exp.normalized[r, ti])
+    print(f"files: {len(paths)}  shape: {exp.raw.shape}")
+    print(f"legacy loop : {t_legacy*1000:9.1f} ms")
+    print(f"array loader: {t_new*1000:9.1f} ms  ({t_legacy/t_new:.1f}x)")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        main(sys.argv[1:])
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            main(write_synthetic(tmp))
@@ -0,0 +1,232 @@
+"""Time and memory-profile the analysis pipeline on synthetic erfc experiments, against recorded baselines.
+
+Usage: python benchmarks/bench_pipeline.py [--preset small|medium|large] [--save-baseline]
+
+Each preset writes replicate .txt files whose profiles follow a constant source diffusing into a gel with a
+known D, plus noise. The stages timed are the ones behind the GUI buttons: loading and normalization
+(process_files), replicate statistics (plot_data), time series lookups (plot_time_series_at_distance) and the
+summary export (export_last_data_as_txt). Times are the best of --repeat runs; peak memory is measured in a
+separate tracemalloc run so tracing does not skew the times. The large preset is loaded as float32 (--dtype).
+
+Results are printed and written as JSON (--output). With a baseline file present, every stage is compared
+against the entry for the same preset and the exit code is 1 when a stage got slower than --tolerance times
+its baseline or a numerical check failed. The checks compare a few replicates against the original
+per-line loaders, lookups and exporter, and the fitted D against the D the data was generated with, also
+for a gel without a partition step at the interface.
+"""
+import argparse
+import filecmp
+import json
+import os
+import platform
+import sys
+import tempfile
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from diffusion_analysis.data import (POSITION_SPACING_UM, ExperimentData, load_experiment,  # noqa: E402
+                                     select_time_indices)
+from diffusion_analysis.diffusion import SCIPY_AVAILABLE, fit_diffusion  # noqa: E402
+from diffusion_analysis.summary import summary_table, time_series_at_distance, write_summary_txt  # noqa: E402
+from bench_export import legacy_export_txt  # noqa: E402
+from bench_ingest import best_of, legacy_process_files  # noqa: E402
+
+PRESETS = {
+    'small': (10, 41, 1000),
+    'medium': (24, 200, 2000),
+    'large': (100, 500, 5000),
+}
+# large is loaded as float32, as ExperimentStore does, so raw and normalized fit in memory next to each other
+PRESET_DTYPES = {'large': 'float32'}
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines.json')
+TIME_INTERVAL = 0.25
+CHECK_REPLICATES = 3
+CHECK_TIMES = 2
+
+
+def synthetic_diffusion_coefficient(n_times, n_positions, interface=0.1):
+    # Chosen so the front reaches a quarter of the gel at the last timepoint and stays semi-infinite
+    gel_length = (1 - interface) * n_positions * POSITION_SPACING_UM
+    t_max = (n_times - 1) * TIME_INTERVAL * 3600
+    return (gel_length / 4) ** 2 / (4 * t_max)
+
+
+def erfc_experiment(n_times, n_positions, diffusion, interface=0.1, source=10000.0, background=700.0,
+                    partition=0.4, noise=0.01, seed=0):
+    """(time, position) profiles of a reservoir at x < interface feeding a gel with partition coefficient."""
+    from scipy.special import erfc
+
+    rng = np.random.default_rng(seed)
+    x = np.arange(n_positions) * POSITION_SPACING_UM
+    x_i = interface * x[-1]
+    t = np.maximum(np.arange(n_times) * TIME_INTERVAL * 3600, 1e-9)[:, None]
+    gel = partition * source * erfc((x[None, :] - x_i) / (2 * np.sqrt(diffusion * t)))
+    profile = np.where(x[None, :] <= x_i, source, gel) + background
+    return np.round(profile + rng.normal(0, noise * source, profile.shape))
+
+
+def write_experiment(directory, n_replicates, n_times, n_positions, seed=0):
+    """Write the replicate files unless a previous run left them in directory; returns (paths, D)."""
+    diffusion = synthetic_diffusion_coefficient(n_times, n_positions)
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for r in range(n_replicates):
+        path = os.path.join(directory, f"erfc_{n_times}x{n_positions}_{r}.txt")
+        if not os.path.exists(path):
+            np.savetxt(path, erfc_experiment(n_times, n_positions, diffusion, seed=seed + r), fmt='%d',
+                       delimiter=',')
+        paths.append(path)
+    return paths, diffusion
+
+
+def measure(func, repeat):
+    """The tracemalloc peak of one run, then the best wall time over repeat runs."""
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    seconds, result = best_of(func, repeat)
+    return {'seconds': seconds, 'peak_bytes': peak}, result
+
+
+def run_stages(paths, out_dir, repeat, dtype=np.float64, n_lookups=20):
+    stages = {}
+    stages['load'], exp = measure(lambda: load_experiment(paths, TIME_INTERVAL, dtype=dtype), repeat)
+    stages['load']['bytes'] = sum(os.path.getsize(p) for p in paths)
+
+    def stats():
+        exp.invalidate_stats()
+        return exp.stats(1)
+
+    stages['stats'], _ = measure(stats, repeat)
+    stages['stats']['bytes'] = exp.raw.nbytes + exp.normalized.nbytes
+
+    all_times = select_time_indices(exp)
+    distances = np.linspace(0, exp.distances[-1], n_lookups)
+    stages['time_series'], _ = measure(
+        lambda: [time_series_at_distance(exp, d, all_times) for d in distances], repeat)
+    stages['time_series']['count'] = n_lookups
+
+    path = os.path.join(out_dir, 'summary.txt')
+    stages['export'], _ = measure(lambda: write_summary_txt(exp, path), repeat)
+    stages['export']['bytes'] = os.path.getsize(path)
+    return stages
+
+
+def run_checks(paths, diffusion, out_dir):
+    """Compare a few replicates against the original implementations and the known D; returns name -> bool."""
+    paths = paths[:CHECK_REPLICATES]
+    groups = legacy_process_files(paths, TIME_INTERVAL)
+    exp = load_experiment(paths, TIME_INTERVAL)
+    checks = {}
+    checks['normalization'] = all(
+        np.allclose(rep['raw'], exp.raw[r, ti]) and np.allclose(rep['normalized'], exp.normalized[r, ti])
+        for ti, t in enumerate(exp.times) for r, rep in enumerate(groups[t]))
+
+    # The original lookup: nearest point within 5 µm, population std
+    ok = True
+    for distance in (0.0, 503.0, float(exp.distances[len(exp.distances) // 2]), float(exp.distances[-1])):
+        series = time_series_at_distance(exp, distance, select_time_indices(exp), interpolate=False, ddof=0)
+        for ti, t in enumerate(exp.times):
+            values = [(rep['raw'][int(round(distance / 10))], rep['normalized'][int(round(distance / 10))])
+                      for rep in groups[t]]
+            raw, norm = np.array(values).T
+            ok &= np.isclose(series['raw_mean'][ti], raw.mean()) and np.isclose(series['raw_std'][ti], raw.std())
+            ok &= np.isclose(series['norm_mean'][ti], norm.mean()) and np.isclose(series['norm_std'][ti],
+                                                                                   norm.std())
+    checks['time_series'] = bool(ok)
+
+    legacy_path = os.path.join(out_dir, 'legacy.txt')
+    new_path = os.path.join(out_dir, 'check.txt')
+    legacy_export_txt({t: groups[t] for t in sorted(groups)[:CHECK_TIMES]}, legacy_path)
+    write_summary_txt(exp, new_path, summary_table(exp, np.arange(CHECK_TIMES)))
+    checks['export'] = filecmp.cmp(legacy_path, new_path, shallow=False)
+
+    if SCIPY_AVAILABLE:
+        fit = fit_diffusion(exp, workers=1)
+        checks['fit_D'] = bool(abs(fit['D'] - diffusion) < 0.05 * diffusion)
+        # Without a partition step the 50% crossing lies inside the gel, not on the interface
+        raw = np.stack([erfc_experiment(*exp.raw.shape[1:], diffusion, partition=1.0, seed=r)
+                        for r in range(CHECK_REPLICATES)])
+        fit = fit_diffusion(ExperimentData(raw, TIME_INTERVAL), workers=1)
+        checks['fit_D_partition_1'] = bool(abs(fit['D'] - diffusion) < 0.05 * diffusion)
+    return checks
+
+
+def compare(result, baseline, tolerance):
+    """Stage names slower than tolerance times the baseline."""
+    slower = []
+    for name, stage in result['stages'].items():
+        reference = baseline.get('stages', {}).get(name)
+        if reference and stage['seconds'] > tolerance * reference['seconds']:
+            slower.append(name)
+    return slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--preset', choices=sorted(PRESETS), default='small')
+    parser.add_argument('--shape', type=int, nargs=3, metavar=('REPLICATES', 'TIMES', 'POSITIONS'),
+                        help="custom size instead of a preset (not compared against baselines)")
+    parser.add_argument('--dtype', choices=('float64', 'float32'),
+                        help="array dtype of the timed stages (default float64, float32 for large)")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--data-dir', help="keep the generated files here and reuse them on the next run")
+    parser.add_argument('--output', help="write the results as JSON")
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true', help="record these results as the baseline")
+    parser.add_argument('--tolerance', type=float, default=1.5)
+    parser.add_argument('--no-check', action='store_true', help="skip the numerical checks")
+    args = parser.parse_args(argv)
+
+    name = 'custom' if args.shape else args.preset
+    shape = tuple(args.shape) if args.shape else PRESETS[args.preset]
+    dtype = args.dtype or PRESET_DTYPES.get(name, 'float64')
+    with tempfile.TemporaryDirectory() as tmp:
+        paths, diffusion = write_experiment(args.data_dir or os.path.join(tmp, 'data'), *shape)
+        result = {
+            'preset': name,
+            'shape': shape,
+            'dtype': dtype,
+            'diffusion': diffusion,
+            'environment': {'python': platform.python_version(), 'numpy': np.__version__,
+                            'machine': platform.machine(), 'cpus': os.cpu_count()},
+            'stages': run_stages(paths, tmp, args.repeat, np.dtype(dtype)),
+        }
+        if not args.no_check:
+            result['checks'] = run_checks(paths, diffusion, tmp)
+
+    print(f"{name}: {shape[0]} replicates x {shape[1]} timepoints x {shape[2]} positions ({dtype})")
+    for stage, values in result['stages'].items():
+        print(f"{stage:12s}: {values['seconds']*1000:10.1f} ms  peak {values['peak_bytes']/1e6:9.1f} MB")
+    for check, ok in result.get('checks', {}).items():
+        print(f"check {check:12s}: {'ok' if ok else 'FAILED'}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+    failed = not all(result.get('checks', {}).values())
+    if args.save_baseline and name != 'custom':
+        baselines[name] = result
+        with open(args.baseline, 'w') as f:
+            json.dump(baselines, f, indent=2)
+            f.write('\n')
+    elif name in baselines:
+        slower = compare(result, baselines[name], args.tolerance)
+        for stage in slower:
+            ratio = result['stages'][stage]['seconds'] / baselines[name]['stages'][stage]['seconds']
+            print(f"regression: {stage} is {ratio:.2f}x its baseline")
+        failed |= bool(slower)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,79 @@
+"""Compare decimated profile rendering against full resolution: draw time, redraw time and SVG size.
+
+Usage: python benchmarks/bench_render.py [file.txt ...]
+Without arguments the synthetic experiment from bench_ingest.py (24 replicates x 41 timepoints) is used with
+1000 and with 4000 positions. Every timepoint is drawn with std bands, as with "Show time points: All".
+The export figure is the 13x15 inch batch figure; the redraw is the 8x8 inch figure embedded in the app,
+updated in place after a control change (here the line style), against drawing the whole canvas.
+"""
+import io
+import os
+import sys
+import tempfile
+
+import matplotlib
+matplotlib.use('Agg')
+from matplotlib.backends.backend_agg import FigureCanvasAgg  # noqa: E402
+from matplotlib.figure import Figure  # noqa: E402
+import matplotlib.pyplot as plt  # noqa: E402
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from diffusion_analysis.data import load_experiment, select_time_indices  # noqa: E402
+from diffusion_analysis.plotting import ProfilePlotter, build_profile_figure  # noqa: E402
+from bench_ingest import best_of, write_synthetic  # noqa: E402
+
+
+def render(exp, full_resolution):
+    time_idx = select_time_indices(exp)
+    fig = build_profile_figure(exp, time_idx, (0.0, float(exp.distances[-1])), full_resolution=full_resolution)
+    fig.canvas.draw()
+    return fig
+
+
+def line_vertices(fig):
+    return sum(len(line.get_xdata()) for ax in fig.axes for line in ax.lines if line.get_visible())
+
+
+def embedded_redraw(exp, full_resolution):
+    # Median of alternating line styles, so every update changes the curves and the legend
+    fig = Figure(figsize=(8, 8))
+    FigureCanvasAgg(fig)
+    plotter = ProfilePlotter(fig)
+    time_idx = select_time_indices(exp)
+    xlim = (0.0, float(exp.distances[-1]))
+    plotter.update(exp, time_idx, xlim, full_resolution=full_resolution)
+    plotter.draw()
+    styles = iter(['-', '--'] * 10)
+
+    def update(draw):
+        plotter.update(exp, time_idx, xlim, line_style=next(styles), layout=False, full_resolution=full_resolution)
+        draw()
+
+    t_blit, _ = best_of(lambda: update(plotter.draw), repeat=5)
+    t_full, _ = best_of(lambda: update(fig.canvas.draw), repeat=5)
+    return t_blit, t_full, line_vertices(fig)
+
+
+def main(paths):
+    exp = load_experiment(paths)
+    exp.stats()
+    print(f"files: {len(paths)}  shape: {exp.raw.shape}")
+    for label, full in (("full resolution", True), ("decimated", False)):
+        t_build, fig = best_of(lambda: render(exp, full))
+        buffer = io.BytesIO()
+        t_svg, _ = best_of(lambda: fig.savefig(buffer, format='svg', bbox_inches='tight'), repeat=1)
+        print(f"{label:16s}: export figure build+draw {t_build*1000:7.1f} ms  svg {t_svg*1000:7.1f} ms "
+              f"{buffer.tell()/1e6:6.2f} MB  line vertices {line_vertices(fig)}")
+        plt.close(fig)
+        t_blit, t_full, vertices = embedded_redraw(exp, full)
+        print(f"{'':16s}  embedded update+redraw {t_blit*1000:7.1f} ms (whole canvas {t_full*1000:7.1f} ms)  "
+              f"line vertices {vertices}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        main(sys.argv[1:])
+    else:
+        for n_positions in (1000, 4000):
+            with tempfile.TemporaryDirectory() as tmp:
+                main(write_synthetic(tmp, n_positions=n_positions))
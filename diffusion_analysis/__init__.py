@@ -0,0 +1,27 @@
+"""Analysis of fluorescence line profiles from diffusion experiments, without the GUI.
+
+project.py builds the Tk interface and command line on these modules; scripts can use them directly.
+"""
+from .batch import find_experiments, process_experiment, run_batch
+from .data import (NORMALIZATION_DEFAULTS, NORMALIZATION_SCOPES, POSITION_SPACING_UM, SOURCE_SINK_ESTIMATORS,
+                   ExperimentData, ProfileCache, load_experiment, normalize_profiles, select_time_indices,
+                   source_sink_levels)
+from .diffusion import diffusion_distances, fit_diffusion, summarize_diffusion_distances, threshold_crossings
+from .live import LiveExperiment, TextFileSource, TiffFolderSource
+from .profiling import PROFILER
+from .store import ExperimentStore, compare_time_series, condition_table
+from .summary import summary_table, time_series_at_distance, time_series_at_distances, write_summary_txt
+from .tiff import extract_chips, extract_chip_profiles, load_experiment_from_tiffs
+
+__all__ = [
+    'find_experiments', 'process_experiment', 'run_batch',
+    'NORMALIZATION_DEFAULTS', 'NORMALIZATION_SCOPES', 'POSITION_SPACING_UM', 'SOURCE_SINK_ESTIMATORS',
+    'ExperimentData', 'ProfileCache', 'load_experiment', 'normalize_profiles', 'select_time_indices',
+    'source_sink_levels',
+    'diffusion_distances', 'fit_diffusion', 'summarize_diffusion_distances', 'threshold_crossings',
+    'LiveExperiment', 'TextFileSource', 'TiffFolderSource',
+    'PROFILER',
+    'ExperimentStore', 'compare_time_series', 'condition_table',
+    'summary_table', 'time_series_at_distance', 'time_series_at_distances', 'write_summary_txt',
+    'extract_chips', 'extract_chip_profiles', 'load_experiment_from_tiffs',
+]
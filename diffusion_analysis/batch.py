@@ -0,0 +1,139 @@
+"""Headless batch processing of every experiment folder under a directory."""
+import os
+
+import matplotlib.pyplot as plt
+import numpy as np
+
+from .data import POSITION_SPACING_UM, ProfileCache, load_experiment, select_time_indices
+from .diffusion import (build_diffusion_distance_figure, build_diffusion_fit_figure, fit_diffusion,
+                        summarize_diffusion_distances, write_diffusion_distance_txt, write_diffusion_fit_txt)
+from .plotting import build_kinetics_figure, build_profile_figure, build_source_sink_figure, build_time_series_figure
+from .profiling import PROFILER, json_lines_sink
+from .summary import (SUMMARY_WRITERS, summary_table, time_series_at_distance, time_series_at_distances,
+                      write_kinetics_txt)
+from .tiff import recorded_spacings
+
+
+def find_experiments(root_dir, exclude=()):
+    """Every directory under root_dir that holds exported .txt replicates, mapped to its sorted file list."""
+    exclude = {os.path.abspath(p) for p in exclude}
+    experiments = {}
+    for dirpath, dirnames, filenames in os.walk(root_dir):
+        dirnames[:] = sorted(d for d in dirnames if os.path.abspath(os.path.join(dirpath, d)) not in exclude)
+        txt_files = sorted(os.path.join(dirpath, f) for f in filenames if f.lower().endswith('.txt'))
+        if txt_files:
+            experiments[dirpath] = txt_files
+    return experiments
+
+
+def process_experiment(name, file_paths, output_dir, time_interval=0.25, distances=(), thresholds=(),
+                       fit=False, formats=('.txt',), cache_dir=None, ddof=1, pixel_size=POSITION_SPACING_UM,
+                       full_resolution=False, profile=None, profile_memory=False, normalization=None):
+    """Load, normalize and export one experiment without any display; returns the written paths.
+
+    With profile set, stage timings are written as JSON lines to that file ('-' for stderr).
+    """
+    plt.switch_backend('Agg')
+    if profile:
+        PROFILER.configure(True, profile_memory, json_lines_sink(None if profile == '-' else profile))
+    with PROFILER.stage('process_experiment', experiment=name, pid=os.getpid()):
+        return _process_experiment(name, file_paths, output_dir, time_interval, distances, thresholds, fit,
+                                   formats, cache_dir, ddof, pixel_size, full_resolution, normalization)
+
+
+def _process_experiment(name, file_paths, output_dir, time_interval, distances, thresholds, fit, formats,
+                        cache_dir, ddof, pixel_size, full_resolution, normalization):
+    cache = ProfileCache(cache_dir) if cache_dir else None
+    exp = load_experiment(file_paths, time_interval, pixel_size, cache=cache, normalization=normalization)
+    os.makedirs(output_dir, exist_ok=True)
+    prefix = os.path.join(output_dir, name)
+    table = summary_table(exp, ddof=ddof)
+    written = []
+    for ext in formats:
+        written.append(prefix + '_summary' + ext)
+        SUMMARY_WRITERS[ext](exp, written[-1], table)
+
+    all_times = select_time_indices(exp)
+    figures = [('_profiles.svg', build_profile_figure(exp, all_times, (0.0, float(exp.distances[-1])), ddof=ddof,
+                                                      full_resolution=full_resolution)),
+               ('_source_sink.svg', build_source_sink_figure(exp, all_times))]
+    for distance in distances:
+        series = time_series_at_distance(exp, distance, all_times, ddof=ddof)
+        if series is not None:
+            figures.append((f'_time_series_{distance:g}um.svg', build_time_series_figure(series, distance)))
+    if len(distances) > 1:
+        kinetics = time_series_at_distances(exp, distances, all_times, ddof=ddof)
+        written.append(prefix + '_kinetics.txt')
+        write_kinetics_txt(kinetics, written[-1])
+        figures.append(('_kinetics.svg', build_kinetics_figure(kinetics)))
+    if thresholds:
+        summary = summarize_diffusion_distances(exp, thresholds, all_times, ddof)
+        written.append(prefix + '_diffusion_distance.txt')
+        write_diffusion_distance_txt(summary, written[-1])
+        figures.append(('_diffusion_distance.svg', build_diffusion_distance_figure(summary)))
+    if fit:
+        # Already inside a batch worker, so fit replicates in-process
+        result = fit_diffusion(exp, all_times, workers=1)
+        written.append(prefix + '_diffusion_fit.txt')
+        write_diffusion_fit_txt(result, written[-1])
+        figures.append(('_diffusion_fit.svg', build_diffusion_fit_figure(result)))
+    for suffix, fig in figures:
+        written.append(prefix + suffix)
+        with PROFILER.stage('export_svg', file=os.path.basename(written[-1])):
+            fig.savefig(written[-1], format='svg', bbox_inches='tight')
+            PROFILER.count(files=1, bytes_written=os.path.getsize(written[-1]))
+        plt.close(fig)
+    return written
+
+
+def experiment_spacing(name, file_paths, pixel_size):
+    """(µm between points, note) for one experiment; note says why the spacing is not pixel_size, or is None.
+
+    The spacing recorded when its chips were extracted from TIFFs (spacing.json, see extract_chips) takes
+    precedence over pixel_size; chips recorded with different spacings get their median.
+    """
+    recorded = [s for s in recorded_spacings(file_paths) if s is not None]
+    if not recorded:
+        return pixel_size, None
+    spacing = float(np.median(recorded))
+    if max(recorded) - min(recorded) > 1e-3 * spacing:
+        return spacing, (f"{name}: chips were extracted with different spacings ({min(recorded):.4g} to "
+                         f"{max(recorded):.4g} µm), using the median {spacing:.4g} µm")
+    if not np.isclose(spacing, pixel_size):
+        return spacing, (f"{name}: using the {spacing:.4g} µm spacing recorded at extraction instead of "
+                         f"{pixel_size:g} µm")
+    return spacing, None
+
+
+def run_batch(root_dir, output_dir, time_interval=0.25, distances=(), thresholds=(), fit=False,
+              formats=('.txt',), workers=None, cache_dir=None, ddof=1, pixel_size=POSITION_SPACING_UM,
+              full_resolution=False, profile=None, profile_memory=False, normalization=None, log=print):
+    """Process every experiment folder under root_dir in parallel (see process_experiment).
+
+    Progress, spacing notes and failures go to log; a failed experiment does not stop the others. Returns
+    {experiment name: written paths, or the exception if it failed}.
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    experiments = find_experiments(root_dir, exclude=[output_dir])
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+        for directory, files in experiments.items():
+            rel = os.path.relpath(directory, root_dir)
+            name = os.path.basename(os.path.abspath(root_dir)) if rel == '.' else rel.replace(os.sep, '_')
+            spacing, note = experiment_spacing(name, files, pixel_size)
+            if note:
+                log(note)
+            futures[pool.submit(process_experiment, name, files, output_dir, time_interval, distances,
+                                  thresholds, fit, formats, cache_dir, ddof, spacing, full_resolution,
+                                  profile, profile_memory, normalization)] = name
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                results[name] = future.result()
+                log(f"{name}: wrote {len(results[name])} files")
+            except Exception as e:
+                results[name] = e
+                log(f"{name}: failed: {e}")
+    return results
@@ -0,0 +1,462 @@
+"""Experiments as dense (replicate, time, position) arrays: loading, caching, normalization, statistics."""
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+
+from .profiling import PROFILER, instrumented
+
+
+SOURCE_SINK_POINTS = 5
+POSITION_SPACING_UM = 10.0
+
+
+def _nanmean(values, axis):
+    # nanmean without the "Mean of empty slice" warning for padded rows
+    count = np.sum(~np.isnan(values), axis=axis)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.nansum(values, axis=axis) / count
+
+
+def _nanstd(values, axis, ddof=0):
+    # std over the non-NaN entries; 0 for a single value, NaN when there is none
+    count = np.sum(~np.isnan(values), axis=axis)
+    mean = _nanmean(values, axis=axis)
+    sq = np.nansum((values - np.expand_dims(mean, axis)) ** 2, axis=axis)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        std = np.sqrt(sq / (count - ddof))
+    return np.where(count > ddof, std, np.where(count > 0, 0.0, np.nan))
+
+
+def read_profile_file(file_path):
+    """Parse one exported .txt file into a (time, position) float array."""
+    return np.loadtxt(file_path, delimiter=',', ndmin=2, dtype=np.float64)
+
+
+def stack_profiles(arrays, dtype=np.float64):
+    """Stack per-file (time, position) arrays into a NaN-padded (replicate, time, position) array."""
+    n_time = max(a.shape[0] for a in arrays)
+    n_pos = max(a.shape[1] for a in arrays)
+    stacked = np.full((len(arrays), n_time, n_pos), np.nan, dtype=dtype)
+    for i, a in enumerate(arrays):
+        stacked[i, :a.shape[0], :a.shape[1]] = a
+    return stacked
+
+
+SOURCE_SINK_ESTIMATORS = ('mean', 'median', 'trimmed', 'plateau')
+NORMALIZATION_SCOPES = ('line', 'replicate', 'experiment')
+NORMALIZATION_DEFAULTS = {'window_um': None, 'estimator': 'mean', 'scope': 'line', 'trim': 0.2, 'tolerance': 0.05}
+
+
+def _trimmed_mean(values, trim, axis=-1):
+    # Mean after dropping the lowest and highest trim fraction of the non-NaN values; trim=0.5 is the median
+    ordered = np.sort(np.moveaxis(values, axis, -1), axis=-1)  # NaN sorts last
+    count = np.sum(~np.isnan(ordered), axis=-1)
+    cut = np.minimum(np.floor(count * trim).astype(int), np.maximum(count - 1, 0) // 2)
+    csum = np.concatenate([np.zeros(ordered.shape[:-1] + (1,)), np.cumsum(np.nan_to_num(ordered), axis=-1)],
+                          axis=-1)
+    total = (np.take_along_axis(csum, (count - cut)[..., None], axis=-1)[..., 0]
+             - np.take_along_axis(csum, cut[..., None], axis=-1)[..., 0])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(count > 0, total / (count - 2 * cut), np.nan)
+
+
+def _plateau_level(window, edge, tolerance):
+    # window runs from the line end inward: mean of the points that stay within tolerance of the end level
+    # edge, up to the first that does not; edge itself if none does
+    run = np.cumprod(np.abs(window - edge[..., None]) <= tolerance[..., None], axis=-1).astype(bool)
+    level = _nanmean(np.where(run, window, np.nan), axis=-1)
+    return np.where(np.isnan(level), edge, level)
+
+
+def _tail_window(raw, counts, n_points):
+    # Last n_points valid points of every line in order, NaN where the line is shorter
+    tail_idx = counts[..., None] - n_points + np.arange(n_points)
+    tail = np.take_along_axis(raw, np.clip(tail_idx, 0, None), axis=-1)
+    tail[tail_idx < 0] = np.nan
+    return tail
+
+
+def source_sink_levels(raw, n_points=SOURCE_SINK_POINTS, estimator='mean', trim=0.2, tolerance=0.05):
+    """Source and sink level of every line from its first/last n_points valid points.
+
+    estimator is the mean, the median, a trimmed mean (trim cut from each side) or 'plateau': the flat stretch
+    at each end around the median of the n_points end points, which may run on up to half the line and stops
+    at the first point further than tolerance x (source - sink) from that median.
+    """
+    counts = np.sum(~np.isnan(raw), axis=-1)
+    if estimator == 'plateau':
+        # Both windows are ordered inward from the line ends and cut at half of each line; NaN ends every run
+        n_search = max(n_points, raw.shape[-1] // 2)
+        inside = np.arange(n_search) < np.maximum(n_points, counts // 2)[..., None]
+        head = np.where(inside, raw[..., :n_search], np.nan)
+        tail = np.where(inside, _tail_window(raw, counts, n_search)[..., ::-1], np.nan)
+        head_edge = _trimmed_mean(head[..., :n_points], 0.5)
+        tail_edge = _trimmed_mean(tail[..., :n_points], 0.5)
+        span = np.abs(head_edge - tail_edge)
+        return (_plateau_level(head, head_edge, tolerance * span),
+                _plateau_level(tail, tail_edge, tolerance * span))
+    head = raw[..., :n_points]
+    tail = _tail_window(raw, counts, n_points)
+    if estimator == 'mean':
+        return _nanmean(head, axis=-1), _nanmean(tail, axis=-1)
+    if estimator == 'median':
+        return _trimmed_mean(head, 0.5), _trimmed_mean(tail, 0.5)
+    if estimator == 'trimmed':
+        return _trimmed_mean(head, trim), _trimmed_mean(tail, trim)
+    raise ValueError(f"Unknown source/sink estimator {estimator!r}, expected one of {SOURCE_SINK_ESTIMATORS}")
+
+
+def window_points(window_um, spacing):
+    """Points in a source/sink window of window_um µm; SOURCE_SINK_POINTS when no width is given."""
+    if window_um is None:
+        return SOURCE_SINK_POINTS
+    return max(1, int(round(window_um / spacing)))
+
+
+def normalize_profiles(raw, n_points=SOURCE_SINK_POINTS, estimator='mean', scope='line', trim=0.2,
+                       tolerance=0.05):
+    """Source/sink levels of every line and the profiles normalized to them, for all lines at once.
+
+    scope='line' scales each line between its own levels. 'replicate' uses the maximum source and minimum
+    sink over the timepoints of each replicate (the first axis) and 'experiment' over the whole array, the
+    Source_max/Sink_min normalization. The returned source/sink are always the per-line levels.
+    """
+    if scope not in NORMALIZATION_SCOPES:
+        raise ValueError(f"Unknown normalization scope {scope!r}, expected one of {NORMALIZATION_SCOPES}")
+    source, sink = source_sink_levels(raw, n_points, estimator, trim, tolerance)
+    top, bottom = source, sink
+    if scope != 'line':
+        axis = tuple(range(1, source.ndim)) if scope == 'replicate' else None
+        top = np.fmax.reduce(source, axis=axis, keepdims=True, initial=np.nan)
+        bottom = np.fmin.reduce(sink, axis=axis, keepdims=True, initial=np.nan)
+    return source, sink, scale_profiles(raw, top, bottom)
+
+
+def scale_profiles(raw, top, bottom):
+    """raw scaled to 0% at bottom and 100% at top; top/bottom broadcast against raw without its last axis."""
+    # Same dtype as raw, so float32 experiments stay float32
+    top, bottom = np.asarray(top), np.asarray(bottom)
+    offset = bottom.astype(raw.dtype)[..., None]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (raw - offset) / (top - bottom).astype(raw.dtype)[..., None] * 100
+
+
+class PositionIndex:
+    """Binary-search lookup on a sorted grid of positions (µm along the line)."""
+
+    def __init__(self, positions):
+        self.positions = np.asarray(positions, dtype=float)
+
+    def nearest(self, query):
+        """Index of the nearest grid position and its distance from each query point."""
+        query = np.asarray(query, dtype=float)
+        hi = np.clip(np.searchsorted(self.positions, query), 1, len(self.positions) - 1)
+        lo = hi - 1
+        idx = np.where(query - self.positions[lo] <= self.positions[hi] - query, lo, hi)
+        return idx, np.abs(self.positions[idx] - query)
+
+    def sample(self, values, query, interpolate=True, tolerance=None):
+        """Values (positions on the last axis) at each query point, shape (..., len(query)).
+
+        Linear interpolation between the neighbouring positions, or the nearest position when interpolate
+        is False. Query points off the grid, or further than tolerance from a position, give NaN.
+        """
+        query = np.atleast_1d(np.asarray(query, dtype=float))
+        positions = self.positions
+        outside = (query < positions[0]) | (query > positions[-1])
+        if interpolate:
+            hi = np.clip(np.searchsorted(positions, query, side='right'), 1, len(positions) - 1)
+            lo = hi - 1
+            frac = (query - positions[lo]) / (positions[hi] - positions[lo])
+            left = values[..., lo]
+            right = values[..., hi]
+            # Exact grid hits must not pick up a NaN neighbour
+            result = np.where(frac == 0, left, np.where(frac == 1, right, left + (right - left) * frac))
+        else:
+            idx, gap = self.nearest(query)
+            result = values[..., idx]
+            if tolerance is not None:
+                outside |= gap > tolerance
+        return np.where(outside, np.nan, result)
+
+
+class ReplicateStats:
+    """Mean, std, SEM and n across replicates for every timepoint.
+
+    raw and normalized hold (time, position) arrays, source and sink (time,) arrays, each as a dict with
+    'mean', 'std', 'sem' and 'n'. std uses the given ddof and is 0 where only one replicate has data.
+    """
+
+    QUANTITIES = ('raw', 'normalized', 'source', 'sink')
+    BLOCK_VALUES = 1 << 24  # values summarized at a time, bounding the temporaries of large experiments
+
+    def __init__(self, exp, ddof=1):
+        self.ddof = ddof
+        for name in self.QUANTITIES:
+            setattr(self, name, self.summarize(getattr(exp, name), ddof))
+
+    @classmethod
+    def summarize(cls, values, ddof):
+        # Blocks of timepoints: every statistic reduces over replicates only, so the results are unchanged
+        step = max(1, cls.BLOCK_VALUES // max(1, values[:, :1].size))
+        if values.ndim < 2 or values.shape[1] <= step:
+            return cls._summarize(values, ddof)
+        parts = [cls._summarize(values[:, i:i + step], ddof) for i in range(0, values.shape[1], step)]
+        return {key: np.concatenate([part[key] for part in parts]) for key in parts[0]}
+
+    @staticmethod
+    def _summarize(values, ddof):
+        n = np.sum(~np.isnan(values), axis=0)
+        std = _nanstd(values, axis=0, ddof=ddof)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            sem = std / np.sqrt(n)
+        return {'mean': _nanmean(values, axis=0), 'std': std, 'sem': sem, 'n': n}
+
+    def update(self, exp, start, stop):
+        """Recompute timepoints start:stop in place, e.g. after new data arrived there."""
+        for name in self.QUANTITIES:
+            part = self.summarize(getattr(exp, name)[:, start:stop], self.ddof)
+            for key, array in getattr(self, name).items():
+                array[start:stop] = part[key]
+
+    def resized(self, n_time):
+        """Copy with the time axis truncated or NaN/0-padded to n_time."""
+        other = ReplicateStats.__new__(ReplicateStats)
+        other.ddof = self.ddof
+        for name in self.QUANTITIES:
+            stats = {}
+            for key, array in getattr(self, name).items():
+                stats[key] = np.full((n_time,) + array.shape[1:], 0 if key == 'n' else np.nan, dtype=array.dtype)
+                keep = min(n_time, len(array))
+                stats[key][:keep] = array[:keep]
+            setattr(other, name, stats)
+        return other
+
+    def view(self, n_time):
+        other = ReplicateStats.__new__(ReplicateStats)
+        other.ddof = self.ddof
+        for name in self.QUANTITIES:
+            setattr(other, name, {key: array[:n_time] for key, array in getattr(self, name).items()})
+        return other
+
+
+class ExperimentData:
+    """One experiment as dense (replicate, time, position) arrays, NaN-padded where replicates differ."""
+
+    def __init__(self, raw, time_interval=0.25, spacing=POSITION_SPACING_UM, file_paths=(), normalization=None):
+        self.raw = raw
+        self.time_interval = time_interval
+        self.spacing = spacing
+        self.file_paths = list(file_paths)
+        self.normalization = dict(NORMALIZATION_DEFAULTS, **(normalization or {}))
+        self.source, self.sink, self.normalized = self._normalize(raw)
+        self._stats = {}
+        self._position_index = None
+        self._position_index_spacing = None
+
+    def _normalize(self, raw):
+        settings = dict(self.normalization)
+        n_points = window_points(settings.pop('window_um'), self.spacing)
+        return normalize_profiles(raw, n_points, **settings)
+
+    def renormalize(self, **settings):
+        """Recompute source/sink and normalized from raw with new settings (keys of NORMALIZATION_DEFAULTS).
+
+        One vectorized pass over the array, so settings can be tried without reloading; replicate statistics
+        are recomputed on next use.
+        """
+        self.normalization = dict(self.normalization, **settings)
+        self.source, self.sink, self.normalized = self._normalize(self.raw)
+        self.invalidate_stats()
+
+    def stats(self, ddof=1):
+        """Replicate statistics, computed on first use and kept until invalidate_stats()."""
+        if ddof not in self._stats:
+            with PROFILER.stage('stats'):
+                self._stats[ddof] = ReplicateStats(self, ddof)
+                PROFILER.count(points=self.raw.size)
+        return self._stats[ddof]
+
+    def invalidate_stats(self):
+        self._stats = {}
+
+    @property
+    def n_replicates(self):
+        return self.raw.shape[0]
+
+    @property
+    def times(self):
+        return np.arange(self.raw.shape[1]) * self.time_interval
+
+    @property
+    def distances(self):
+        return np.arange(self.raw.shape[2]) * self.spacing
+
+    @property
+    def position_index(self):
+        # Rebuilt only when the pixel size changes
+        if self._position_index_spacing != self.spacing:
+            self._position_index = PositionIndex(self.distances)
+            self._position_index_spacing = self.spacing
+        return self._position_index
+
+    @property
+    def valid(self):
+        # (replicate, time) mask of timepoints actually present in each file
+        return ~np.all(np.isnan(self.raw), axis=-1)
+
+
+class ProfileCache:
+    """On-disk cache of parsed profile files as memory-mapped .npy arrays.
+
+    data/<sha1 of content>.npy holds the parsed array; stat/<sha1 of path, size, mtime> names the content hash
+    of a file as last seen, so an unchanged file is found without reading it. Every write is an atomic rename,
+    which lets batch workers share one cache directory. Least recently used arrays are evicted once the
+    cache grows beyond max_bytes.
+    """
+
+    DEFAULT_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'fluorescence_analyzer')
+
+    def __init__(self, cache_dir=None, max_bytes=1 << 30):
+        self.cache_dir = cache_dir or self.DEFAULT_DIR
+        self.max_bytes = max_bytes
+        self.data_dir = os.path.join(self.cache_dir, 'data')
+        self.stat_dir = os.path.join(self.cache_dir, 'stat')
+        os.makedirs(self.data_dir, exist_ok=True)
+        os.makedirs(self.stat_dir, exist_ok=True)
+
+    @staticmethod
+    def _stat_key(file_path):
+        st = os.stat(file_path)
+        key = f"{os.path.abspath(file_path)}|{st.st_size}|{st.st_mtime_ns}"
+        return hashlib.sha1(key.encode()).hexdigest()
+
+    @staticmethod
+    def _content_hash(file_path):
+        h = hashlib.sha1()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+        return h.hexdigest()
+
+    @staticmethod
+    def _write_atomic(path, write):
+        # A unique temporary file per call: threads of one process (a cancelled load still finishing its file
+        # and the next load) and batch workers can write the same entry at the same time
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            os.replace(tmp, path)
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+    def load(self, file_path):
+        stat_path = os.path.join(self.stat_dir, self._stat_key(file_path))
+        digest = None
+        try:
+            with open(stat_path) as f:
+                digest = f.read().strip()
+        except FileNotFoundError:
+            pass
+        if not digest:
+            digest = self._content_hash(file_path)
+            self._write_atomic(stat_path, lambda f: f.write(digest.encode()))
+        data_path = os.path.join(self.data_dir, digest + '.npy')
+        try:
+            array = np.load(data_path, mmap_mode='r')
+            os.utime(data_path)
+            return array
+        except (FileNotFoundError, ValueError):
+            pass
+        array = read_profile_file(file_path)
+        self._write_atomic(data_path, lambda f: np.save(f, array))
+        self.evict()
+        return array
+
+    def _arrays(self):
+        # (mtime, size, path) of every cached array; another thread or worker may evict any of them meanwhile
+        arrays = []
+        for entry in os.scandir(self.data_dir):
+            if entry.name.endswith('.npy'):
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                arrays.append((st.st_mtime, st.st_size, entry.path))
+        return arrays
+
+    def size(self):
+        return sum(size for _, size, _ in self._arrays())
+
+    def evict(self):
+        arrays = sorted(self._arrays())
+        total = sum(size for _, size, _ in arrays)
+        evicted = False
+        for _, size, path in arrays:
+            if total <= self.max_bytes:
+                break
+            total -= size
+            evicted = True
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        if evicted:
+            # Drop stat entries whose array is gone so they don't accumulate; leave files still being written
+            for entry in os.scandir(self.stat_dir):
+                if entry.name.endswith('.tmp'):
+                    continue
+                try:
+                    with open(entry.path) as f:
+                        digest = f.read().strip()
+                except FileNotFoundError:
+                    continue
+                if not os.path.exists(os.path.join(self.data_dir, digest + '.npy')):
+                    try:
+                        os.remove(entry.path)
+                    except FileNotFoundError:
+                        pass
+
+    def clear(self):
+        for directory in (self.data_dir, self.stat_dir):
+            for entry in os.scandir(directory):
+                os.remove(entry.path)
+
+
+@instrumented
+def load_experiment(file_paths, time_interval=0.25, spacing=POSITION_SPACING_UM, cache=None, progress=None,
+                    dtype=np.float64, normalization=None):
+    """Load replicate .txt files; progress(done, total, message) is called after each file if given."""
+    arrays = []
+    with PROFILER.stage('read'):
+        for i, path in enumerate(file_paths):
+            # Parsed files take the target dtype right away; cached ones stay memory-mapped until stacked
+            arrays.append(cache.load(path) if cache is not None else read_profile_file(path).astype(dtype, copy=False))
+            if PROFILER.enabled:
+                # Cached files are memory-mapped, so only parsed text counts as bytes read
+                PROFILER.count(files=1, bytes_read=0 if cache is not None else os.path.getsize(path),
+                               rows=len(arrays[-1]), points=arrays[-1].size)
+            if progress is not None:
+                progress(i + 1, len(file_paths), os.path.basename(path))
+    with PROFILER.stage('stack'):
+        raw = stack_profiles(arrays, dtype)
+        del arrays
+    with PROFILER.stage('normalize'):
+        return ExperimentData(raw, time_interval, spacing, file_paths, normalization)
+
+
+def select_time_indices(exp, interval=None, min_time=None, max_time=None):
+    """Indices of the timepoints inside [min_time, max_time] that fall on multiples of interval."""
+    times = exp.times
+    keep = np.any(exp.valid, axis=0)
+    if min_time is not None:
+        keep &= times >= min_time
+    if max_time is not None:
+        keep &= times <= max_time
+    if interval is not None:
+        keep &= np.abs(times / interval - np.round(times / interval)) < 1e-6
+    return np.flatnonzero(keep)
@@ -0,0 +1,285 @@
+"""Diffusion distance at normalized thresholds and the diffusion coefficient from erfc fits."""
+import matplotlib.pyplot as plt
+import numpy as np
+
+try:
+    from scipy.optimize import curve_fit
+    from scipy.special import erfc
+    from scipy.stats import t as t_dist
+    SCIPY_AVAILABLE = True
+except ImportError:
+    SCIPY_AVAILABLE = False
+
+from .data import _nanmean, _nanstd, select_time_indices
+from .plotting import _new_figure
+from .profiling import instrumented, instrumented_writer
+
+
+# Diffusion distance
+
+def parse_float_list(text):
+    return [float(v) for v in text.replace(';', ',').split(',') if v.strip()]
+
+
+def threshold_crossings(profiles, distances, threshold):
+    """Distance where each profile first drops below threshold, linearly interpolated between positions.
+
+    profiles has positions on the last axis; profiles that never cross give NaN.
+    """
+    crossing = (profiles[..., :-1] >= threshold) & (profiles[..., 1:] < threshold)
+    found = crossing.any(axis=-1)
+    j = np.argmax(crossing, axis=-1)[..., None]
+    p0 = np.take_along_axis(profiles, j, axis=-1)[..., 0]
+    p1 = np.take_along_axis(profiles, j + 1, axis=-1)[..., 0]
+    x0 = distances[j[..., 0]]
+    x1 = distances[j[..., 0] + 1]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        frac = (p0 - threshold) / (p0 - p1)
+    return np.where(found, x0 + frac * (x1 - x0), np.nan)
+
+
+def diffusion_distances(exp, thresholds, time_idx=None):
+    """(threshold, replicate, time) array of threshold crossing distances in µm."""
+    normalized = exp.normalized if time_idx is None else exp.normalized[:, time_idx]
+    return np.stack([threshold_crossings(normalized, exp.distances, thr) for thr in thresholds])
+
+
+@instrumented
+def summarize_diffusion_distances(exp, thresholds, time_idx=None, ddof=1):
+    """Threshold crossing distances per replicate and their mean, std (with ddof) and n across replicates."""
+    if time_idx is None:
+        time_idx = select_time_indices(exp)
+    dist = diffusion_distances(exp, thresholds, time_idx)
+    return {
+        'thresholds': np.asarray(thresholds, dtype=float),
+        'times': exp.times[time_idx],
+        'distances': dist,
+        'mean': _nanmean(dist, axis=1),
+        'std': _nanstd(dist, axis=1, ddof=ddof),
+        'n': np.sum(~np.isnan(dist), axis=1),
+    }
+
+
+@instrumented
+def build_diffusion_distance_figure(summary, line_style='-', marker='o', show_std=True, show_grid=True,
+                                    font_size=12, cmap='viridis', fig=None):
+    fig = _new_figure(fig, (10, 6))
+    ax = fig.subplots()
+    cmap = plt.colormaps.get_cmap(cmap)
+    marker = marker if marker != 'None' else None
+    n = len(summary['thresholds'])
+    for k, thr in enumerate(summary['thresholds']):
+        ax.errorbar(summary['times'], summary['mean'][k], yerr=summary['std'][k] if show_std else None,
+                    linestyle=line_style, marker=marker, color=cmap(k / max(1, n - 1)),
+                    label=f'{thr:g}% threshold')
+    ax.set_xlabel('Time (hours)', fontsize=font_size)
+    ax.set_ylabel('Diffusion distance (µm)', fontsize=font_size)
+    ax.set_title('Diffusion Distance Over Time', fontsize=font_size)
+    ax.grid(show_grid)
+    ax.legend(fontsize=font_size)
+    return fig
+
+
+@instrumented_writer
+def write_diffusion_distance_txt(summary, file_path):
+    with open(file_path, 'w') as f:
+        f.write("# Diffusion Distance (Mean ± Std across replicates)\n")
+        f.write("# Time(h)\tThreshold(%)\tDistanceMean(um)\tDistanceStd(um)\tN\n")
+        for ti, t in enumerate(summary['times']):
+            for k, thr in enumerate(summary['thresholds']):
+                f.write(f"{t:.2f}\t{thr:g}\t{summary['mean'][k, ti]:.3f}\t"
+                        f"{summary['std'][k, ti]:.3f}\t{summary['n'][k, ti]}\n")
+
+
+# Diffusion coefficient fitting (Fick's law, constant source at the gel interface)
+
+# erfc(z) = 0.5 and 0.05; the latter marks where the semi-infinite solution still fits inside the line
+ERFC_HALF = 0.476936
+ERFC_TAIL = 1.385904
+MIN_FIT_AMPLITUDE = 5.0
+
+
+def erfc_profile(x, amplitude, width, x0=0.0):
+    """amplitude*erfc((x - x0)/width), the profile behind a constant source at x0 with width = 2*sqrt(D*t)."""
+    return amplitude * erfc((x - x0) / width)
+
+
+def _resolved_fits(params, spacing):
+    # Fits with no measurable front: a flat gel (t ≈ 0, amplitude near 0, any width) or a step narrower than
+    # two positions. Their widths say nothing about D.
+    with np.errstate(invalid='ignore'):
+        return (params[..., 0] >= MIN_FIT_AMPLITUDE) & (params[..., 2] >= 2 * spacing)
+
+
+def _fit_replicate(profiles, distances):
+    # Fits one replicate's timepoints in order, seeding each fit with the previous result.
+    # Only points past the 50% crossing are fitted: at the interface the profile steps down from the source
+    # to the partition level, so they lie in the gel whatever the partition coefficient. The interface is a
+    # free parameter up to the crossing, which is where it sits for partitions below 0.5; nearer 1 the profile
+    # leaves the source smoothly and the crossing is well inside the gel. It is then fixed at the median over
+    # the resolved frames (it does not move) and the frames refitted, keeping its noise out of the widths.
+    # Columns: amplitude, interface (µm), width (µm)
+    params = np.full((profiles.shape[0], 3), np.nan)
+    spacing = distances[1] - distances[0]
+    gels = {}
+    guess = None
+    for ti, y in enumerate(profiles):
+        crossing = threshold_crossings(y, distances, 50.0)
+        if not crossing > distances[0]:
+            continue
+        gel = (distances > crossing) & ~np.isnan(y)
+        if gel.sum() < 5:
+            continue
+        x = distances[gel]
+        y = y[gel]
+        gels[ti] = x, y
+        if guess is None:
+            amplitude = max(np.mean(y[:3]), 1e-3)
+            half = threshold_crossings(y, x, amplitude / 2)
+            width = (half - crossing) / ERFC_HALF if half > crossing else 0.25 * (x[-1] - crossing)
+            guess = [amplitude, crossing, width]
+        guess[1] = np.clip(guess[1], distances[0], crossing)
+        try:
+            popt, _ = curve_fit(lambda x, a, x0, w: erfc_profile(x, a, w, x0), x, y, p0=guess,
+                                bounds=([0, distances[0], 1e-6], [np.inf, crossing, np.inf]))
+        except (RuntimeError, ValueError):
+            continue
+        params[ti] = popt
+        # A frame without a front (e.g. t = 0) is no starting point for the next one
+        guess = list(popt) if _resolved_fits(popt, spacing) else None
+
+    resolved = _resolved_fits(params, spacing)
+    if not resolved.any():
+        return params
+    interface = np.median(params[resolved, 1])
+    for ti, (x, y) in gels.items():
+        keep = x > interface
+        guess = params[ti, [0, 2]] if not np.isnan(params[ti, 0]) else [max(np.mean(y[:3]), 1e-3), x[-1] / 4]
+        try:
+            popt, _ = curve_fit(lambda x, a, w: erfc_profile(x, a, w, interface), x[keep], y[keep], p0=guess,
+                                bounds=([0, 1e-6], [np.inf, np.inf]))
+        except (RuntimeError, ValueError):
+            continue
+        params[ti] = popt[0], interface, popt[1]
+    return params
+
+
+def _diffusion_regression(times, widths_sq, confidence):
+    # width² = 4*D*(t + t0): the slope gives D independently of when diffusion started
+    ok = ~np.isnan(widths_sq)
+    n = int(ok.sum())
+    if n < 3:
+        return np.nan, (np.nan, np.nan)
+    coef, cov = np.polyfit(times[ok], widths_sq[ok], 1, cov=True)
+    half = t_dist.ppf(0.5 + confidence / 2, n - 2) * np.sqrt(cov[0, 0])
+    to_d = 1 / (4 * 3600)  # µm²/h -> µm²/s
+    return coef[0] * to_d, ((coef[0] - half) * to_d, (coef[0] + half) * to_d)
+
+
+def _worker_context():
+    # The GUI fits from a worker thread of the Tk process; forking a multi-threaded process can deadlock
+    import multiprocessing
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+@instrumented
+def fit_diffusion(exp, time_idx=None, workers=None, confidence=0.95, progress=None):
+    """Fit every normalized profile beyond the interface with erfc_profile and derive D in µm²/s.
+
+    The interface is fitted (see _fit_replicate), so the partition coefficient does not bias D, and the
+    baseline is the normalized sink (0). Replicates are fitted in parallel in forkserver (or spawned) worker
+    processes, which are safe to start from the GUI's task thread; workers=1 fits in-process. D per replicate
+    and the pooled D come from the slope of width² over time, using only timepoints where the fitted profile
+    has decayed below 5% before the end of the line, i.e. where the semi-infinite solution still holds, and that show a front at all (at least MIN_FIT_AMPLITUDE % and two positions wide).
+    """
+    if not SCIPY_AVAILABLE:
+        raise RuntimeError("Diffusion fitting requires scipy")
+    if time_idx is None:
+        time_idx = select_time_indices(exp)
+    times = exp.times[time_idx]
+    profiles = exp.normalized[:, time_idx]
+    params = np.empty(profiles.shape[:2] + (3,))
+    if workers == 1 or exp.n_replicates == 1:
+        for r, p in enumerate(profiles):
+            params[r] = _fit_replicate(p, exp.distances)
+            if progress is not None:
+                progress(r + 1, len(profiles), f"replicate {r + 1}")
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers, mp_context=_worker_context()) as pool:
+            futures = [pool.submit(_fit_replicate, p, exp.distances) for p in profiles]
+            try:
+                for r, future in enumerate(futures):
+                    params[r] = future.result()
+                    if progress is not None:
+                        progress(r + 1, len(profiles), f"replicate {r + 1}")
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+
+    widths = params[..., 2]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        d_t = np.where(times > 0, widths ** 2 / (4 * times * 3600), np.nan)
+        semi_infinite = (exp.distances[-1] - params[..., 1]) / widths > ERFC_TAIL
+    used = semi_infinite & _resolved_fits(params, exp.spacing)
+    widths_sq = np.where(used, widths ** 2, np.nan)
+    per_rep = [_diffusion_regression(times, w, confidence) for w in widths_sq]
+    pooled, pooled_ci = _diffusion_regression(np.tile(times, len(widths_sq)), widths_sq.ravel(), confidence)
+    return {
+        'times': times,
+        'params': params,
+        'D_t': d_t,
+        'used': used,
+        'D_replicate': np.array([d for d, _ in per_rep]),
+        'D_replicate_ci': np.array([ci for _, ci in per_rep]),
+        'D': pooled,
+        'D_ci': pooled_ci,
+        'confidence': confidence,
+    }
+
+
+@instrumented
+def build_diffusion_fit_figure(fit, marker='o', show_grid=True, font_size=12, cmap='viridis', fig=None):
+    fig = _new_figure(fig, (10, 8))
+    ax1, ax2 = fig.subplots(2, 1, sharex=True)
+    cmap = plt.colormaps.get_cmap(cmap)
+    marker = marker if marker != 'None' else None
+    times = fit['times']
+    n = len(fit['D_t'])
+    for r in range(n):
+        color = cmap(r / max(1, n - 1))
+        used = fit['used'][r]
+        ax1.plot(times, fit['D_t'][r], linestyle='-', marker=marker, color=color, label=f'Replicate {r + 1}')
+        ax2.plot(times[used], fit['params'][r, used, 2] ** 2, linestyle='None', marker=marker, color=color)
+        ax2.plot(times[~used], fit['params'][r, ~used, 2] ** 2, linestyle='None', marker=marker, color=color,
+                 alpha=0.3)
+    ax1.axhline(fit['D'], color='black', linestyle='--', label='Pooled D')
+    ax1.set_ylabel('D(t) (µm²/s)', fontsize=font_size)
+    ax1.grid(show_grid)
+    ax1.legend(fontsize=font_size)
+    ax2.set_xlabel('Time (hours)', fontsize=font_size)
+    ax2.set_ylabel('Fitted width² (µm²)', fontsize=font_size)
+    ax2.grid(show_grid)
+    low, high = fit['D_ci']
+    fig.suptitle(f"D = {fit['D']:.3g} µm²/s ({fit['confidence']:.0%} CI {low:.3g} – {high:.3g})",
+                 fontsize=font_size)
+    fig.tight_layout()
+    return fig
+
+
+@instrumented_writer
+def write_diffusion_fit_txt(fit, file_path):
+    with open(file_path, 'w') as f:
+        low, high = fit['D_ci']
+        f.write("# Diffusion Coefficient Fit (erfc profile behind the interface, D in um^2/s)\n")
+        f.write(f"# Pooled D\t{fit['D']:.6g}\t{fit['confidence']:.0%} CI\t{low:.6g}\t{high:.6g}\n")
+        for r, (d, (lo, hi)) in enumerate(zip(fit['D_replicate'], fit['D_replicate_ci'])):
+            f.write(f"# Replicate {r + 1} D\t{d:.6g}\tCI\t{lo:.6g}\t{hi:.6g}\n")
+        f.write("# Replicate\tTime(h)\tAmplitude\tInterface(um)\tWidth(um)\tD(t)\tUsedInPooledD\n")
+        for r in range(len(fit['params'])):
+            for ti, t in enumerate(fit['times']):
+                a, x0, w = fit['params'][r, ti]
+                f.write(f"{r + 1}\t{t:.2f}\t{a:.6f}\t{x0:.3f}\t{w:.3f}\t{fit['D_t'][r, ti]:.6g}\t"
+                        f"{int(fit['used'][r, ti])}\n")
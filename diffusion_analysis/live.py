@@ -0,0 +1,266 @@
+"""Live acquisition: ingest timepoints while a timelapse is still being written."""
+import os
+
+import numpy as np
+
+from .data import (NORMALIZATION_DEFAULTS, NORMALIZATION_SCOPES, POSITION_SPACING_UM, ExperimentData,
+                   ReplicateStats, scale_profiles, source_sink_levels, window_points)
+from .tiff import (ROI_FILENAME, line_sample_coords, list_timepoint_images, load_line_roi, open_tiff,
+                   sample_line_profiles)
+
+
+class TextFileSource:
+    """New complete lines of a growing exported .txt file, read from where the previous poll stopped.
+
+    A complete line that does not parse raises once with the file name and byte offset and is then skipped as
+    a NaN timepoint, so the replicate keeps its time alignment and goes on with the next lines.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0
+        self._width = None  # values per line, for the NaN row of a skipped line
+        self._pending = []
+
+    def poll(self):
+        rows, self._pending = self._pending, []
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(self.offset)
+                chunk = f.read()
+        except FileNotFoundError:
+            return rows
+        end = chunk.rfind(b'\n') + 1  # an unterminated last line is still being written
+        consumed = 0
+        for line in chunk[:end].splitlines(keepends=True):
+            if line.strip():
+                try:
+                    row = np.array(line.decode().split(','), dtype=np.float64)
+                except ValueError:
+                    if rows:
+                        break  # return the rows before it; the line raises on the next poll
+                    self.offset += consumed + len(line)
+                    self._pending = [np.full(self._width or line.count(b',') + 1, np.nan)]
+                    text = line.decode(errors='replace').strip()[:40]
+                    raise ValueError(f"{os.path.basename(self.path)}: cannot parse line at byte "
+                                     f"{self.offset - len(line)}: {text!r}; skipped") from None
+                rows.append(row)
+                self._width = len(row)
+            consumed += len(line)
+        self.offset += consumed
+        return rows
+
+
+class TiffFolderSource:
+    """Line profiles of timepoint images added to a chip folder since the previous poll.
+
+    Only the newest image may still be being written: while it fails to read and its size keeps changing it
+    is retried on the next poll. Any other image that cannot be read, or the newest once its size has settled,
+    raises once with the file name and becomes a NaN timepoint, so the replicate stays aligned in time.
+    """
+
+    def __init__(self, folder, roi=None):
+        self.folder = folder
+        self.roi = roi or load_line_roi(os.path.join(folder, ROI_FILENAME))
+        self.coords = line_sample_coords(self.roi)
+        self.n_done = 0
+        self._newest = None  # (path, size) of the newest image when it last failed to read
+        self._pending = []
+
+    def poll(self):
+        rows, self._pending = self._pending, []
+        paths = list_timepoint_images(self.folder, self.roi)
+        for i in range(self.n_done, len(paths)):
+            path = paths[i]
+            try:
+                profiles = sample_line_profiles(open_tiff(path), *self.coords)
+            except Exception as e:
+                if i == len(paths) - 1:
+                    newest = (path, os.path.getsize(path))
+                    if newest != self._newest:
+                        self._newest = newest  # probably still being written; retry on the next poll
+                        break
+                if rows:
+                    break  # return what was read; this image raises on the next poll
+                self.n_done += 1
+                self._pending = [np.full(self.roi['n_points'], np.nan)]
+                raise ValueError(f"{os.path.basename(path)}: cannot read image ({e}); skipped") from e
+            rows.extend(profiles)
+            self.n_done += 1
+        return rows
+
+
+class LiveExperiment(ExperimentData):
+    """ExperimentData that grows along time as its sources (one per replicate) produce new timepoints.
+
+    Arrays are preallocated with doubling capacity; each poll parses, normalizes and updates the replicate
+    statistics of the new timepoints only, so the cost per timepoint does not grow with the run length. With a
+    replicate or experiment normalization scope the running maximum source and minimum sink are kept, and the
+    timepoints received earlier are only rescaled when a new timepoint moves one of them.
+    """
+
+    def __init__(self, sources, time_interval=0.25, spacing=POSITION_SPACING_UM, capacity=64, normalization=None):
+        self.sources = list(sources)
+        self.time_interval = time_interval
+        self.spacing = spacing
+        self.normalization = dict(NORMALIZATION_DEFAULTS, **(normalization or {}))
+        self.file_paths = [getattr(src, 'path', getattr(src, 'folder', None)) for src in self.sources]
+        self._capacity = capacity
+        self._n_time = 0
+        self._n_rows = np.zeros(len(self.sources), dtype=int)
+        self._buffers = None
+        self._top = np.full(len(self.sources), np.nan)  # running max source / min sink of each replicate
+        self._bottom = np.full(len(self.sources), np.nan)
+        self._applied = (self._top.copy(), self._bottom.copy())  # reference levels the normalized buffer is scaled to
+        self._stats = {}
+        self._position_index = None
+        self._position_index_spacing = None
+        self.source_errors = []
+
+    def _allocate(self, n_pos):
+        shape = (len(self.sources), self._capacity)
+        self._buffers = {
+            'raw': np.full(shape + (n_pos,), np.nan),
+            'normalized': np.full(shape + (n_pos,), np.nan),
+            'source': np.full(shape, np.nan),
+            'sink': np.full(shape, np.nan),
+        }
+
+    def _grow(self, needed):
+        capacity = self._capacity
+        while capacity < needed:
+            capacity *= 2
+        for key, buf in self._buffers.items():
+            grown = np.full((buf.shape[0], capacity) + buf.shape[2:], np.nan)
+            grown[:, :self._capacity] = buf
+            self._buffers[key] = grown
+        self._stats = {ddof: stats.resized(capacity) for ddof, stats in self._stats.items()}
+        self._capacity = capacity
+
+    def _view(self, key):
+        if self._buffers is None:
+            return np.empty((len(self.sources), 0, 0) if key in ('raw', 'normalized') else (len(self.sources), 0))
+        return self._buffers[key][:, :self._n_time]
+
+    @property
+    def raw(self):
+        return self._view('raw')
+
+    @property
+    def normalized(self):
+        return self._view('normalized')
+
+    @property
+    def source(self):
+        return self._view('source')
+
+    @property
+    def sink(self):
+        return self._view('sink')
+
+    def renormalize(self, **settings):
+        settings = dict(self.normalization, **settings)
+        if settings['scope'] not in NORMALIZATION_SCOPES:
+            raise ValueError(f"Unknown normalization scope {settings['scope']!r}, expected one of "
+                             f"{NORMALIZATION_SCOPES}")
+        self.normalization = settings
+        if self._buffers is not None:
+            self._renormalize_received()
+
+    def _levels(self, raw):
+        settings = dict(self.normalization)
+        n_points = window_points(settings.pop('window_um'), self.spacing)
+        del settings['scope']
+        return source_sink_levels(raw, n_points, **settings)
+
+    def _reference(self):
+        # Source_max/Sink_min each replicate is scaled to, from the running extremes of its lines
+        if self.normalization['scope'] == 'replicate':
+            return self._top.copy(), self._bottom.copy()
+        n = len(self.sources)
+        return (np.full(n, np.fmax.reduce(self._top, initial=np.nan)),
+                np.full(n, np.fmin.reduce(self._bottom, initial=np.nan)))
+
+    def _rescale(self, r, start):
+        # Normalize timepoints start: of replicate r against the current reference
+        stop = self._n_rows[r]
+        if self.normalization['scope'] == 'line':
+            top, bottom = self._buffers['source'][r, start:stop], self._buffers['sink'][r, start:stop]
+        else:
+            top, bottom = self._applied[0][r], self._applied[1][r]
+        self._buffers['normalized'][r, start:stop] = scale_profiles(self._buffers['raw'][r, start:stop], top,
+                                                                    bottom)
+
+    def _renormalize_received(self):
+        source, sink = self._levels(self.raw)
+        self._buffers['source'][:, :self._n_time] = source
+        self._buffers['sink'][:, :self._n_time] = sink
+        self._top = np.fmax.reduce(source, axis=1, initial=np.nan)
+        self._bottom = np.fmin.reduce(sink, axis=1, initial=np.nan)
+        self._applied = self._reference()
+        for r in range(len(self.sources)):
+            self._rescale(r, 0)
+        self._stats = {}
+
+    def stats(self, ddof=1):
+        if self._buffers is None:
+            return ReplicateStats(self, ddof)
+        if ddof not in self._stats:
+            self._stats[ddof] = ReplicateStats(self, ddof).resized(self._capacity)
+        return self._stats[ddof].view(self._n_time)
+
+    def poll(self):
+        """Read new timepoints from every source; returns the (start, stop) range of timepoints that changed.
+
+        A source that fails to read is skipped for this poll and its error kept in source_errors, so the
+        others still advance.
+        """
+        first, last = None, None
+        self.source_errors = []
+        received = {}
+        for r, src in enumerate(self.sources):
+            try:
+                rows = src.poll()
+            except (OSError, ValueError) as e:
+                self.source_errors.append(e)
+                continue
+            if not rows:
+                continue
+            if self._buffers is None:
+                self._allocate(len(rows[0]))
+            start = self._n_rows[r]
+            stop = start + len(rows)
+            if stop > self._capacity:
+                self._grow(stop)
+            n_pos = self._buffers['raw'].shape[2]
+            block = self._buffers['raw'][r, start:stop]
+            for i, row in enumerate(rows):
+                block[i, :min(n_pos, len(row))] = row[:n_pos]
+            source, sink = self._levels(block)
+            self._buffers['source'][r, start:stop] = source
+            self._buffers['sink'][r, start:stop] = sink
+            self._top[r] = np.fmax.reduce(source, initial=self._top[r])
+            self._bottom[r] = np.fmin.reduce(sink, initial=self._bottom[r])
+            self._n_rows[r] = stop
+            received[r] = start
+            first = start if first is None else min(first, start)
+            last = stop if last is None else max(last, stop)
+        if first is None:
+            return None
+        self._n_time = max(self._n_time, int(last))
+        if self.normalization['scope'] != 'line':
+            # A new max source/min sink changes the scale of everything received so far for the replicates
+            # it applies to; otherwise only the new timepoints need scaling
+            reference = self._reference()
+            moved = np.zeros(len(self.sources), dtype=bool)
+            for new, old in zip(reference, self._applied):
+                moved |= ~((new == old) | (np.isnan(new) & np.isnan(old)))
+            self._applied = reference
+            received.update((r, 0) for r in np.flatnonzero(moved))
+            if moved.any():
+                first, last = 0, self._n_time
+        for r, start in received.items():
+            self._rescale(r, start)
+        for stats in self._stats.values():
+            stats.update(self, first, last)
+        return int(first), int(last)
@@ -0,0 +1,300 @@
+"""Profile, time series and source/sink figures, with profiles decimated to the figure width."""
+import matplotlib.pyplot as plt
+from matplotlib.collections import PolyCollection
+import numpy as np
+
+from .profiling import PROFILER, instrumented
+
+
+def _new_figure(fig, figsize):
+    """A fresh pyplot figure, or the given (e.g. embedded) figure cleared for reuse."""
+    if fig is None:
+        return plt.figure(figsize=figsize)
+    fig.clear()
+    return fig
+
+
+def _band_vertices(x, low, high):
+    ok = np.isfinite(low) & np.isfinite(high)
+    x, low, high = x[ok], low[ok], high[ok]
+    return np.concatenate([np.column_stack([x, low]), np.column_stack([x[::-1], high[::-1]])])
+
+
+def _buckets(x, ys, n_buckets):
+    # (rows, buckets, width) views of x and ys, padded with the last x and NaN; None if already small enough
+    n = ys.shape[-1]
+    if n <= 2 * n_buckets:
+        return None
+    width = -(-n // n_buckets)
+    pad = -n % width
+    xb = np.concatenate([x, np.full(pad, x[-1])]).reshape(-1, width)
+    yb = np.concatenate([ys, np.full(ys.shape[:-1] + (pad,), np.nan)], axis=-1)
+    return xb, yb.reshape(ys.shape[:-1] + xb.shape)
+
+
+def decimate_minmax(x, ys, n_buckets):
+    """Reduce each row of ys to the min and max of n_buckets equal x-ranges, in x order.
+
+    Peaks and steps survive at any zoom where a bucket is no wider than a pixel. Returns (xs, ys) with one
+    row per input row; rows short enough already are returned as they are.
+    """
+    ys = np.atleast_2d(ys)
+    buckets = _buckets(x, ys, n_buckets)
+    if buckets is None:
+        return np.broadcast_to(x, ys.shape), ys
+    xb, yb = buckets
+    filled = np.isnan(yb)
+    lo = np.argmin(np.where(filled, np.inf, yb), axis=-1)
+    hi = np.argmax(np.where(filled, -np.inf, yb), axis=-1)
+    idx = np.stack([np.minimum(lo, hi), np.maximum(lo, hi)], axis=-1)
+    xs = np.take_along_axis(np.broadcast_to(xb, yb.shape), idx, axis=-1)
+    return xs.reshape(len(ys), -1), np.take_along_axis(yb, idx, axis=-1).reshape(len(ys), -1)
+
+
+def decimate_band(x, low, high, n_buckets):
+    """Envelope of a (low, high) band: the lowest low and highest high of each bucket, at the bucket centre."""
+    low, high = np.atleast_2d(low), np.atleast_2d(high)
+    buckets = _buckets(x, low, n_buckets)
+    if buckets is None:
+        return np.broadcast_to(x, low.shape), low, high
+    xb, lb = buckets
+    hb = _buckets(x, high, n_buckets)[1]
+    centres = np.broadcast_to((xb[:, 0] + xb[:, -1]) / 2, lb.shape[:-1])
+    return centres, np.fmin.reduce(lb, axis=-1), np.fmax.reduce(hb, axis=-1)
+
+
+class ProfilePlotter:
+    """The raw/normalized profile figure, redrawn in place.
+
+    Lines are pooled and reused, and the std bands of each axis are one PolyCollection. Unless
+    full_resolution is set, profiles are decimated to the axis width in pixels before drawing. draw() keeps
+    the rendered axes, ticks and labels and, while they stay the same, only redraws the curves, bands and
+    legend on top of them.
+    """
+
+    def __init__(self, fig):
+        self.fig = fig
+        self.axes = fig.subplots(2, 1)
+        self.lines = ([], [])
+        self.bands = tuple(ax.add_collection(PolyCollection([], alpha=0.2, linewidth=0), autolim=False)
+                           for ax in self.axes)
+        self.legend = None
+        self._style = None
+        self._background = None
+        self._background_key = None
+
+    def _buckets_for(self, ax, distances, xlim):
+        # One bucket per two typographic points (1/36 inch) of the visible range, so the min/max pairs come to
+        # about a vertex per point in an SVG and per 1.4 pixels on a 100 dpi screen
+        span = (xlim[1] - xlim[0]) or 1.0
+        width = ax.bbox.width / self.fig.dpi * 72
+        return max(2, int(width / 2 * (distances[-1] - distances[0]) / span))
+
+    def update(self, exp, time_idx, xlim, line_style='-', cmap='viridis', show_std=True, show_grid=True,
+               font_size=12, legend_interval=1.0, ddof=1, layout=True, full_resolution=False):
+        ax1, ax2 = self.axes
+        cmap = plt.colormaps.get_cmap(cmap)
+        distances = exp.distances
+        times = exp.times
+        stats = exp.stats(ddof)
+        colors = [cmap(idx / max(1, len(time_idx)-1)) for idx in range(len(time_idx))]
+        panels = ((ax1, exp.raw, stats.raw), (ax2, exp.normalized, stats.normalized))
+
+        # Per axis, the curves to draw (mean, or each replicate when there is no std) and the bands
+        curve_time = []
+        band_time = []
+        valid = exp.valid[:, time_idx]
+        for idx, ti in enumerate(time_idx):
+            reps = np.flatnonzero(valid[:, idx])
+            if len(reps) > 1 and show_std:
+                curve_time.append((idx, ti, None))
+                band_time.append((idx, ti))
+            else:
+                curve_time.extend((idx, ti, r) for r in reps)
+
+        with PROFILER.stage('artists'):
+            legend_handles = []
+            legend_labels = []
+            for k, (ax, values, panel_stats) in enumerate(panels):
+                curves = np.array([panel_stats['mean'][ti] if r is None else values[r, ti]
+                                   for _, ti, r in curve_time])
+                curves = curves.reshape(len(curve_time), len(distances))
+                mean = panel_stats['mean'][[ti for _, ti in band_time]]
+                std = panel_stats['std'][[ti for _, ti in band_time]]
+                low, high = mean - std, mean + std
+                if full_resolution:
+                    xs, ys = np.broadcast_to(distances, curves.shape), curves
+                    bx = np.broadcast_to(distances, low.shape)
+                else:
+                    n_buckets = self._buckets_for(ax, distances, xlim)
+                    xs, ys = decimate_minmax(distances, curves, n_buckets)
+                    bx, low, high = decimate_band(distances, low, high, n_buckets)
+
+                # Raw data on the top axis, normalized data below
+                pool = self.lines[k]
+                for i, (idx, ti, _) in enumerate(curve_time):
+                    if i == len(pool):
+                        pool.append(ax.plot([], [])[0])
+                    line = pool[i]
+                    line.set_data(xs[i], ys[i])
+                    line.set_color(colors[idx])
+                    line.set_linestyle(line_style)
+                    line.set_visible(True)
+                    # Add to legend, once per timepoint
+                    t = times[ti]
+                    if k == 1 and abs(t % legend_interval) < 1e-6 and (i + 1 == len(curve_time) or
+                                                                      curve_time[i + 1][0] != idx):
+                        legend_handles.append(line)
+                        legend_labels.append(f'Time {t:.2f}h')
+                for line in pool[len(curve_time):]:
+                    line.set_visible(False)
+                PROFILER.count(points=xs.size)
+                self.bands[k].set_verts([_band_vertices(bx[i], low[i], high[i])
+                                         for i in range(len(band_time))])
+                self.bands[k].set_facecolor([colors[idx] for idx, _ in band_time])
+
+                if k == 0:
+                    finite = np.concatenate([curves.ravel(), low.ravel(), high.ravel()])
+                    finite = finite[np.isfinite(finite)]
+                    if finite.size:
+                        margin = 0.05 * (finite.max() - finite.min()) or 1.0
+                        ax1.set_ylim(finite.min() - margin, finite.max() + margin)
+
+        # Configure axes
+        ax1.set_xlim(*xlim)
+        ax2.set_xlim(*xlim)
+        ax1.set_title('Raw Fluorescence Data', fontsize=font_size)
+        ax1.set_ylabel('Fluorescence (a.u.)', fontsize=font_size)
+        ax1.grid(show_grid)
+        ax2.set_title('Normalized Fluorescence Data', fontsize=font_size)
+        ax2.set_xlabel('Distance (µm)', fontsize=font_size)
+        ax2.set_ylabel('Normalized Intensity (%)', fontsize=font_size)
+        ax2.set_ylim(-10, 110)
+        ax2.grid(show_grid)
+
+        # Add legend
+        if self.legend is not None:
+            self.legend.remove()
+            self.legend = None
+        if legend_handles:
+            self.legend = self.fig.legend(legend_handles, legend_labels, title='Time Points',
+                                          loc='upper right', bbox_to_anchor=(0.95, 0.8),
+                                          fontsize=font_size, ncol=3)
+            for i, text in enumerate(self.legend.get_texts()):
+                text.set_color(legend_handles[i].get_color())
+
+        # tight_layout needs a full text layout pass, so in-place redraws skip it unless fonts changed
+        if layout:
+            with PROFILER.stage('layout'):
+                self.fig.tight_layout()
+                self.fig.subplots_adjust(right=0.85)
+        self._style = (font_size, show_grid)
+        return self.fig
+
+    def _data_artists(self):
+        artists = [a for band, pool in zip(self.bands, self.lines) for a in [band] + pool]
+        return artists + ([self.legend] if self.legend is not None else [])
+
+    def draw(self):
+        """Render on the figure canvas after update().
+
+        The figure without curves, bands and legend is kept as a background; as long as the figure size, axes
+        positions, limits, fonts and grid are unchanged only the curves, bands and legend are drawn over it.
+        """
+        canvas = self.fig.canvas
+        key = (tuple(self.fig.bbox.bounds), self._style,
+               tuple((tuple(ax.get_position().bounds), ax.get_xlim(), ax.get_ylim()) for ax in self.axes))
+        artists = self._data_artists()
+        if self._background is None or key != self._background_key:
+            shown = [a.get_visible() for a in artists]
+            for artist in artists:
+                artist.set_visible(False)
+            canvas.draw()
+            self._background = canvas.copy_from_bbox(self.fig.bbox)
+            self._background_key = key
+            for artist, visible in zip(artists, shown):
+                artist.set_visible(visible)
+        else:
+            canvas.restore_region(self._background)
+        for artist in artists:
+            if artist.get_visible():
+                (artist.axes or self.fig).draw_artist(artist)
+        canvas.blit(self.fig.bbox)
+
+
+@instrumented
+def build_profile_figure(exp, time_idx, xlim, line_style='-', cmap='viridis', show_std=True,
+                         show_grid=True, font_size=12, legend_interval=1.0, ddof=1, fig=None,
+                         full_resolution=False):
+    fig = _new_figure(fig, (13, 15))
+    return ProfilePlotter(fig).update(exp, time_idx, xlim, line_style, cmap, show_std, show_grid, font_size,
+                                      legend_interval, ddof, full_resolution=full_resolution)
+
+
+@instrumented
+def build_time_series_figure(series, distance, line_style='-', marker='o', show_std=True,
+                             show_grid=True, font_size=12, fig=None):
+    fig = _new_figure(fig, (10, 8))
+    ax1, ax2 = fig.subplots(2, 1, sharex=True)
+    marker = marker if marker != 'None' else None
+
+    # Raw values plot with std
+    ax1.errorbar(series['times'], series['raw_mean'], yerr=series['raw_std'] if show_std else None,
+                 linestyle=line_style, color='blue', label='Raw Fluorescence', marker=marker)
+    ax1.set_ylabel('Fluorescence (a.u.)', fontsize=font_size)
+    ax1.grid(show_grid)
+    ax1.tick_params(labelsize=font_size)
+
+    # Normalized values plot with std
+    ax2.errorbar(series['times'], series['norm_mean'], yerr=series['norm_std'] if show_std else None,
+                 linestyle=line_style, color='green', label='Normalized Fluorescence', marker=marker)
+    ax2.set_xlabel('Time (hours)', fontsize=font_size)
+    ax2.set_ylabel('Normalized (%)', fontsize=font_size)
+    ax2.grid(show_grid)
+    ax2.tick_params(labelsize=font_size)
+
+    fig.suptitle(f'Fluorescence at {distance}µm', fontsize=font_size)
+    fig.tight_layout()
+    return fig
+
+
+@instrumented
+def build_kinetics_figure(series, line_style='-', marker='None', show_std=True, show_grid=True,
+                          font_size=12, cmap='viridis', fig=None):
+    fig = _new_figure(fig, (10, 6))
+    ax = fig.subplots()
+    cmap = plt.colormaps.get_cmap(cmap)
+    marker = marker if marker != 'None' else None
+    n = len(series['distances'])
+    for k, distance in enumerate(series['distances']):
+        color = cmap(k / max(1, n - 1))
+        mean = series['norm_mean'][k]
+        ax.plot(series['times'], mean, linestyle=line_style, marker=marker, color=color, label=f'{distance:g} µm')
+        if show_std:
+            std = series['norm_std'][k]
+            ax.fill_between(series['times'], mean - std, mean + std, color=color, alpha=0.2)
+    ax.set_xlabel('Time (hours)', fontsize=font_size)
+    ax.set_ylabel('Normalized (%)', fontsize=font_size)
+    ax.set_title('Normalized Fluorescence Over Time', fontsize=font_size)
+    ax.grid(show_grid)
+    ax.legend(fontsize=font_size, ncol=max(1, n // 10))
+    return fig
+
+
+@instrumented
+def build_source_sink_figure(exp, time_idx, line_style='-', show_grid=True, font_size=12, fig=None):
+    times = exp.times[time_idx]
+    stats = exp.stats()
+    sources = stats.source['mean'][time_idx]
+    sinks = stats.sink['mean'][time_idx]
+
+    fig = _new_figure(fig, (10, 6))
+    ax = fig.subplots()
+    ax.plot(times, sources, linestyle=line_style, color='blue', label='Source')
+    ax.plot(times, sinks, linestyle=line_style, color='red', label='Sink')
+    ax.set_xlabel('Time (hours)', fontsize=font_size)
+    ax.set_ylabel('Fluorescence (a.u.)', fontsize=font_size)
+    ax.set_title('Source and Sink Values Over Time', fontsize=font_size)
+    ax.grid(show_grid)
+    ax.legend(fontsize=font_size)
+    return fig
@@ -0,0 +1,145 @@
+"""Per-stage timings, counters and peak memory of the pipeline, written as JSON lines when enabled."""
+import contextlib
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+
+class StageProfiler:
+    """Optional per-stage instrumentation: wall time, tracemalloc peak and counters (bytes, rows, points).
+
+    Disabled by default, when a stage costs one attribute check. Stages nest per thread and are named by
+    their path, e.g. "process_files/load_experiment/read"; keyword tags given to stage() are copied to the
+    records of nested stages. Each finished stage is appended to records and passed to sink(record).
+    Memory tracing slows Python-heavy code and tracemalloc peaks are process-wide, so it has its own switch
+    and peaks of stages running concurrently in several threads overlap.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.trace_memory = False
+        self.sink = None
+        self.records = []
+        self._local = threading.local()
+        self._started_tracing = False
+
+    def configure(self, enabled=True, trace_memory=False, sink=None):
+        self.enabled = enabled
+        self.trace_memory = enabled and trace_memory
+        self.sink = sink
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        elif not self.trace_memory and self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextlib.contextmanager
+    def stage(self, name, **tags):
+        if not self.enabled:
+            yield
+            return
+        stack = self._stack()
+        parent = stack[-1] if stack else None
+        tags = dict(parent['tags'] if parent else {}, **tags)
+        record = dict(tags, stage=f"{parent['record']['stage']}/{name}" if parent else name)
+        entry = {'record': record, 'tags': tags}
+        if self.trace_memory and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            if parent is not None:
+                parent['peak'] = max(parent['peak'], peak)
+            tracemalloc.reset_peak()
+            entry['start'] = entry['peak'] = current
+        stack.append(entry)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            record['seconds'] = time.perf_counter() - start
+            stack.pop()
+            if 'peak' in entry and tracemalloc.is_tracing():
+                entry['peak'] = max(entry['peak'], tracemalloc.get_traced_memory()[1])
+                record['peak_bytes'] = entry['peak'] - entry['start']
+                if parent is not None and 'peak' in parent:
+                    parent['peak'] = max(parent['peak'], entry['peak'])
+            self.records.append(record)
+            if self.sink is not None:
+                self.sink(record)
+
+    def count(self, **values):
+        """Add to the counters of the innermost running stage of this thread."""
+        stack = self._stack() if self.enabled else None
+        if stack:
+            record = stack[-1]['record']
+            for key, value in values.items():
+                record[key] = record.get(key, 0) + int(value)
+
+    def clear(self):
+        self.records = []
+
+
+PROFILER = StageProfiler()
+STAGE_COUNTERS = ('files', 'bytes_read', 'bytes_written', 'rows', 'points')
+
+
+def instrumented(func):
+    """Run func as a PROFILER stage named after it."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not PROFILER.enabled:
+            return func(*args, **kwargs)
+        with PROFILER.stage(func.__name__):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def instrumented_writer(func):
+    """Like instrumented, for writers called as func(data, file_path, ...); counts the bytes written."""
+    @functools.wraps(func)
+    def wrapper(data, file_path, *args, **kwargs):
+        if not PROFILER.enabled:
+            return func(data, file_path, *args, **kwargs)
+        with PROFILER.stage(func.__name__):
+            result = func(data, file_path, *args, **kwargs)
+            PROFILER.count(files=1, bytes_written=os.path.getsize(file_path))
+            return result
+    return wrapper
+
+
+def json_lines_sink(path=None):
+    """A PROFILER sink writing each record as one JSON line, appended to path or written to stderr."""
+    def sink(record):
+        line = json.dumps(record, default=float) + '\n'
+        if path is None:
+            sys.stderr.write(line)
+            sys.stderr.flush()
+        else:
+            with open(path, 'a') as f:
+                f.write(line)
+    return sink
+
+
+def summarize_stages(records):
+    """Per stage path, in order of first appearance: calls, total/max seconds, max peak and summed counters."""
+    summary = {}
+    for record in records:
+        row = summary.setdefault(record['stage'], {'stage': record['stage'], 'calls': 0, 'seconds': 0.0,
+                                                   'max_seconds': 0.0, 'peak_bytes': None})
+        row['calls'] += 1
+        row['seconds'] += record['seconds']
+        row['max_seconds'] = max(row['max_seconds'], record['seconds'])
+        if 'peak_bytes' in record:
+            row['peak_bytes'] = max(row['peak_bytes'] or 0, record['peak_bytes'])
+        for key in STAGE_COUNTERS:
+            if key in record:
+                row[key] = row.get(key, 0) + record[key]
+    return list(summary.values())
@@ -0,0 +1,205 @@
+"""Multi-experiment store: index many experiments by filename metadata and load them on demand."""
+import os
+import re
+
+import matplotlib.pyplot as plt
+import numpy as np
+
+from .batch import find_experiments
+from .data import (NORMALIZATION_DEFAULTS, POSITION_SPACING_UM, _nanmean, _nanstd, load_experiment,
+                   select_time_indices)
+from .diffusion import diffusion_distances
+from .plotting import _new_figure
+from .profiling import instrumented, instrumented_writer
+from .summary import time_series_at_distance
+
+
+EXPERIMENT_METADATA = ('date', 'chip', 'ratio', 'kda', 'duration_h', 'dye')
+_NAME_TOKENS = (
+    ('date', re.compile(r'^(\d{8})$'), str),
+    ('ratio', re.compile(r'^(\d+(?:\.\d+)?-\d+(?:\.\d+)?)$'), str),
+    ('kda', re.compile(r'^(\d+(?:\.\d+)?)\s*kda$', re.IGNORECASE), float),
+    ('duration_h', re.compile(r'^(\d+(?:\.\d+)?)\s*h$', re.IGNORECASE), float),
+    ('dye', re.compile(r'^([a-z][a-z0-9-]*)$', re.IGNORECASE), str),
+)
+_CHIP_TOKEN = re.compile(r'^chip\s*(\d+)(?:\.(\d+))?$', re.IGNORECASE)
+
+
+def parse_experiment_name(file_name):
+    """Metadata from a name like "20250403_chip 5.1_50-50_4kDa_10h_FITC.txt"; missing fields are None.
+
+    Tokens are separated by underscores and recognized by their form, in any order. "chip 5.1" is chip 5,
+    replicate 1.
+    """
+    meta = dict.fromkeys(EXPERIMENT_METADATA + ('replicate',))
+    for token in os.path.splitext(os.path.basename(file_name))[0].split('_'):
+        token = token.strip()
+        chip = _CHIP_TOKEN.match(token)
+        if chip:
+            meta['chip'], meta['replicate'] = chip.group(1), chip.group(2)
+            continue
+        for key, pattern, convert in _NAME_TOKENS:
+            match = pattern.match(token)
+            if match and meta[key] is None:
+                meta[key] = convert(match.group(1))
+                break
+    # Any other word would pass for a dye, so a dye alone does not make a name parseable
+    if not any(meta[k] for k in EXPERIMENT_METADATA if k != 'dye'):
+        meta['dye'] = None
+    return meta
+
+
+def experiment_label(meta):
+    parts = [meta['date'], meta['chip'] and f"chip {meta['chip']}", meta['ratio'],
+             meta['kda'] is not None and f"{meta['kda']:g}kDa",
+             meta['duration_h'] is not None and f"{meta['duration_h']:g}h", meta['dye']]
+    return ' '.join(p for p in parts if p)
+
+
+class ExperimentStore:
+    """Many experiments indexed by filename metadata, loaded only when their data is needed.
+
+    Replicate files in one folder whose names differ only in the replicate number (chip 5.1, 5.2, ...) form
+    one experiment. Indexing reads names only. load() keeps the max_loaded most recently used experiments,
+    stored as dtype (float32 by default, half the memory of the main view's float64), so comparing many
+    conditions costs memory for the few being looked at rather than everything indexed.
+    """
+
+    def __init__(self, time_interval=0.25, spacing=POSITION_SPACING_UM, cache=None, max_loaded=4,
+                 dtype=np.float32, normalization=None):
+        self.time_interval = time_interval
+        self.spacing = spacing
+        self.cache = cache
+        self.max_loaded = max_loaded
+        self.dtype = dtype
+        self.normalization = dict(NORMALIZATION_DEFAULTS, **(normalization or {}))
+        self.entries = {}
+        self._loaded = {}
+
+    def add_folder(self, root_dir, exclude=()):
+        """Index every .txt replicate under root_dir; returns the keys of the experiments found."""
+        added = []
+        for directory, files in find_experiments(root_dir, exclude).items():
+            groups = {}
+            for path in files:
+                meta = parse_experiment_name(path)
+                if not any(meta[k] for k in EXPERIMENT_METADATA):
+                    meta['chip'] = os.path.basename(os.path.abspath(directory))
+                groups.setdefault(tuple(meta[k] for k in EXPERIMENT_METADATA), []).append(path)
+            for values, paths in groups.items():
+                meta = dict(zip(EXPERIMENT_METADATA, values))
+                key = experiment_label(meta)
+                existing = self.entries.get(key)
+                if existing is not None and existing['directory'] != directory:
+                    key = f"{key} [{os.path.relpath(directory, root_dir)}]"
+                self.entries[key] = dict(meta, key=key, directory=directory, files=sorted(paths))
+                self._loaded.pop(key, None)
+                added.append(key)
+        return added
+
+    def select(self, **criteria):
+        """Keys whose metadata match every criterion; a list or tuple value matches any of its items."""
+        keys = []
+        for key, entry in self.entries.items():
+            if all(entry[k] in v if isinstance(v, (list, tuple, set)) else entry[k] == v
+                   for k, v in criteria.items()):
+                keys.append(key)
+        return keys
+
+    def groups(self, by=('ratio', 'kda', 'dye'), keys=None):
+        """Keys grouped by the given metadata fields, e.g. every chip of one condition together."""
+        grouped = {}
+        for key in self.entries if keys is None else keys:
+            grouped.setdefault(tuple(self.entries[key][k] for k in by), []).append(key)
+        return grouped
+
+    def load(self, key):
+        if key in self._loaded:
+            self._loaded[key] = self._loaded.pop(key)
+            return self._loaded[key]
+        entry = self.entries[key]
+        exp = load_experiment(entry['files'], self.time_interval, self.spacing, cache=self.cache, dtype=self.dtype,
+                              normalization=self.normalization)
+        self._loaded[key] = exp
+        while len(self._loaded) > self.max_loaded:
+            del self._loaded[next(iter(self._loaded))]
+        return exp
+
+    def set_normalization(self, normalization):
+        """Normalize experiments with these settings from now on, dropping those loaded with others."""
+        normalization = dict(NORMALIZATION_DEFAULTS, **(normalization or {}))
+        if normalization != self.normalization:
+            self.normalization = normalization
+            self.release()
+
+    def loaded_bytes(self):
+        return sum(exp.raw.nbytes + exp.normalized.nbytes for exp in self._loaded.values())
+
+    def release(self):
+        self._loaded = {}
+
+
+@instrumented
+def compare_time_series(store, keys, distance, interval=None, interpolate=True, ddof=1):
+    """Normalized mean/std over time at one distance for each experiment, keyed like keys; None where no data."""
+    series = {}
+    for key in keys:
+        exp = store.load(key)
+        series[key] = time_series_at_distance(exp, distance, select_time_indices(exp, interval), interpolate,
+                                              ddof)
+    return series
+
+
+@instrumented
+def build_overlay_figure(series, distance, line_style='-', marker='None', show_std=True, show_grid=True,
+                         font_size=12, cmap='viridis', fig=None):
+    fig = _new_figure(fig, (10, 6))
+    ax = fig.subplots()
+    cmap = plt.colormaps.get_cmap(cmap)
+    marker = marker if marker != 'None' else None
+    shown = [(key, s) for key, s in series.items() if s is not None]
+    for k, (key, s) in enumerate(shown):
+        color = cmap(k / max(1, len(shown) - 1))
+        ax.plot(s['times'], s['norm_mean'], linestyle=line_style, marker=marker, color=color, label=key)
+        if show_std:
+            ax.fill_between(s['times'], s['norm_mean'] - s['norm_std'], s['norm_mean'] + s['norm_std'],
+                            color=color, alpha=0.2)
+    ax.set_xlabel('Time (hours)', fontsize=font_size)
+    ax.set_ylabel('Normalized (%)', fontsize=font_size)
+    ax.set_title(f'Normalized Fluorescence at {distance:g}µm', fontsize=font_size)
+    ax.grid(show_grid)
+    if shown:
+        ax.legend(fontsize=font_size)
+    return fig
+
+
+CONDITION_COLUMNS = EXPERIMENT_METADATA + ('replicates', 'timepoints', 'positions', 'final_time_h',
+                                           'front_mean_um', 'front_std_um')
+
+
+@instrumented
+def condition_table(store, keys, threshold=50.0, ddof=1):
+    """One row per experiment: its metadata, size and the threshold front at the last timepoint (mean, std)."""
+    rows = []
+    for key in keys:
+        exp = store.load(key)
+        last = exp.times.size - 1
+        fronts = diffusion_distances(exp, [threshold], [last])[0, :, 0] if last >= 0 else np.array([])
+        entry = store.entries[key]
+        rows.append(dict(
+            {k: entry[k] for k in EXPERIMENT_METADATA},
+            replicates=exp.n_replicates, timepoints=exp.times.size, positions=exp.distances.size,
+            final_time_h=float(exp.times[last]) if last >= 0 else np.nan,
+            front_mean_um=float(_nanmean(fronts, axis=0)) if fronts.size else np.nan,
+            front_std_um=float(_nanstd(fronts, axis=0, ddof=ddof)) if fronts.size else np.nan))
+    return rows
+
+
+@instrumented_writer
+def write_condition_table_txt(rows, file_path):
+    with open(file_path, 'w') as f:
+        f.write("# Experiment Comparison\n")
+        f.write("# " + "\t".join(CONDITION_COLUMNS) + "\n")
+        for row in rows:
+            cells = (row[c] for c in CONDITION_COLUMNS)
+            f.write("\t".join('' if v is None else f"{v:g}" if isinstance(v, float) else str(v) for v in cells) + "\n")
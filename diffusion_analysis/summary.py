@@ -0,0 +1,103 @@
+"""Time series at chosen distances and the summary tables exported as .txt, .npz or .parquet."""
+from importlib.util import find_spec
+
+import numpy as np
+
+from .data import _nanmean, _nanstd, select_time_indices
+from .profiling import instrumented, instrumented_writer
+
+
+# pandas plus a Parquet engine; imported only when a Parquet export is requested
+PARQUET_AVAILABLE = find_spec('pandas') is not None and (
+    find_spec('pyarrow') is not None or find_spec('fastparquet') is not None)
+
+
+@instrumented
+def time_series_at_distances(exp, distances, time_idx, interpolate=True, ddof=1):
+    """Raw and normalized mean/std over time at many distances at once, as (distance, time) matrices.
+
+    Each replicate is sampled at the requested distances (see PositionIndex.sample) before the statistics are
+    taken, so interpolated std is the std of interpolated replicates.
+    """
+    distances = np.atleast_1d(np.asarray(distances, dtype=float))
+    index = exp.position_index
+    tolerance = None if interpolate else exp.spacing / 2
+    series = {'distances': distances, 'times': exp.times[time_idx]}
+    for key, values in (('raw', exp.raw), ('norm', exp.normalized)):
+        sampled = index.sample(values[:, time_idx], distances, interpolate, tolerance)
+        series[key + '_mean'] = _nanmean(sampled, axis=0).T
+        series[key + '_std'] = _nanstd(sampled, axis=0, ddof=ddof).T
+    return series
+
+
+def time_series_at_distance(exp, distance, time_idx, interpolate=True, ddof=1):
+    """Mean/std of raw and normalized values over time at one distance, or None if there is no data there."""
+    if not len(time_idx):
+        return None
+    series = time_series_at_distances(exp, [distance], time_idx, interpolate, ddof)
+    if np.all(np.isnan(series['norm_mean'])):
+        return None
+    return {key: value[0] if key.endswith(('_mean', '_std')) else value
+            for key, value in series.items() if key != 'distances'}
+
+
+@instrumented_writer
+def write_kinetics_txt(series, file_path):
+    with open(file_path, 'w') as f:
+        f.write("# Normalized Fluorescence Over Time (Mean ± Std across replicates)\n")
+        f.write("# Time(h)" + "".join(f"\tMean_{d:g}um\tStd_{d:g}um" for d in series['distances']) + "\n")
+        columns = [series['times']]
+        for k in range(len(series['distances'])):
+            columns += [series['norm_mean'][k], series['norm_std'][k]]
+        np.savetxt(f, np.column_stack(columns), fmt='%.6f', delimiter='\t')
+
+
+SUMMARY_COLUMNS = ('time_h', 'distance_um', 'raw_mean', 'raw_std', 'norm_mean', 'norm_std', 'n')
+
+
+@instrumented
+def summary_table(exp, time_idx=None, ddof=1):
+    """Per-timepoint, per-distance mean ± std as flat columns, one row per (time, distance) with data."""
+    if time_idx is None:
+        time_idx = select_time_indices(exp)
+    stats = exp.stats(ddof)
+    n = stats.raw['n'][time_idx]
+    times, distances = np.meshgrid(exp.times[time_idx], exp.distances, indexing='ij')
+    columns = (times, distances, stats.raw['mean'][time_idx], stats.raw['std'][time_idx],
+               stats.normalized['mean'][time_idx], stats.normalized['std'][time_idx], n)
+    present = n > 0
+    return dict(zip(SUMMARY_COLUMNS, (c[present] for c in columns)))
+
+
+@instrumented_writer
+def write_summary_txt(exp, file_path, table=None):
+    table = summary_table(exp) if table is None else table
+    rows = np.column_stack([table[c] for c in SUMMARY_COLUMNS[:-1]])
+    with open(file_path, 'w') as f:
+        f.write("# Exported Fluorescence Data (Mean ± Std)\n")
+        f.write("# Time(h)\tDistance(um)\tRawMean\tRawStd\tNormMean\tNormStd\n")
+        if len(rows):
+            np.savetxt(f, rows, fmt="%.2f\t%.1f\t%.6f\t%.6f\t%.6f\t%.6f")
+
+
+@instrumented_writer
+def write_summary_npz(exp, file_path, table=None):
+    table = summary_table(exp) if table is None else table
+    np.savez_compressed(file_path, **table)
+
+
+@instrumented_writer
+def write_summary_parquet(exp, file_path, table=None):
+    if not PARQUET_AVAILABLE:
+        raise RuntimeError("Parquet export requires pandas and pyarrow (or fastparquet)")
+    import pandas as pd
+
+    table = summary_table(exp) if table is None else table
+    pd.DataFrame(table).to_parquet(file_path, index=False)
+
+
+SUMMARY_WRITERS = {
+    '.txt': write_summary_txt,
+    '.npz': write_summary_npz,
+    '.parquet': write_summary_parquet,
+}
@@ -0,0 +1,353 @@
+"""Line-profile extraction from TIFF time series (replaces the MATLAB line ROI step)."""
+import hashlib
+import json
+import os
+import re
+import time
+
+import numpy as np
+
+try:
+    import tifffile
+    TIFFFILE_AVAILABLE = True
+except ImportError:
+    TIFFFILE_AVAILABLE = False
+
+from .data import POSITION_SPACING_UM, ExperimentData, stack_profiles
+from .profiling import instrumented
+
+
+TIFF_EXTENSIONS = ('.tif', '.tiff')
+ROI_FILENAME = 'roi.json'
+GRAY_WEIGHTS = np.array([0.2989, 0.5870, 0.1140])  # same weights as MATLAB's im2gray
+
+
+def _natural_key(name):
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r'(\d+)', name)]
+
+
+def list_tiffs(folder):
+    return sorted((f for f in os.listdir(folder) if f.lower().endswith(TIFF_EXTENSIONS)), key=_natural_key)
+
+
+def list_timepoint_images(folder, roi=None):
+    """Timepoint images of a chip folder in natural order, leaving out the brightfield reference."""
+    brightfield = find_brightfield(folder, roi)
+    return [os.path.join(folder, f) for f in list_tiffs(folder) if os.path.join(folder, f) != brightfield]
+
+
+def find_brightfield(folder, roi=None):
+    """The brightfield reference of a chip folder, or None.
+
+    A 'brightfield' file name in the ROI decides (null: the folder has none). Otherwise it is the image named
+    brightfield, or else the first image, as in the MATLAB workflow.
+    """
+    if roi is not None and 'brightfield' in roi:
+        return os.path.join(folder, roi['brightfield']) if roi['brightfield'] else None
+    tiffs = list_tiffs(folder)
+    named = [f for f in tiffs if 'brightfield' in f.lower()]
+    return os.path.join(folder, (named or tiffs)[0]) if tiffs else None
+
+
+def save_line_roi(path, start, end, n_points=200, width=1, um_per_pixel=None, brightfield=None):
+    """Store a line ROI; start/end are (x, y) = (column, row) pixel coordinates, 0-based.
+
+    brightfield is the file name of the reference image the line was drawn on, which extraction then skips.
+    """
+    roi = {'start': [float(v) for v in start], 'end': [float(v) for v in end], 'n_points': int(n_points),
+           'width': int(width), 'um_per_pixel': um_per_pixel}
+    if brightfield is not None:
+        roi['brightfield'] = brightfield
+    with open(path, 'w') as f:
+        json.dump(roi, f, indent=2)
+    return roi
+
+
+def load_line_roi(path):
+    with open(path) as f:
+        roi = json.load(f)
+    roi.setdefault('width', 1)
+    roi.setdefault('um_per_pixel', None)
+    return roi
+
+
+def roi_spacing(roi):
+    """µm between sampled points; falls back to the default spacing when the pixel size is unknown."""
+    if not roi.get('um_per_pixel'):
+        return POSITION_SPACING_UM
+    (x0, y0), (x1, y1) = roi['start'], roi['end']
+    return float(np.hypot(x1 - x0, y1 - y0) / (roi['n_points'] - 1) * roi['um_per_pixel'])
+
+
+def line_sample_coords(roi):
+    """(rows, cols) of the nearest pixels at n_points along the line, shape (width, n_points).
+
+    Rows of the result are parallel lines one pixel apart, centred on the ROI, to be averaged.
+    """
+    (x0, y0), (x1, y1) = roi['start'], roi['end']
+    t = np.linspace(0, 1, roi['n_points'])
+    length = np.hypot(x1 - x0, y1 - y0)
+    normal = np.array([-(y1 - y0), x1 - x0]) / length if length else np.zeros(2)
+    offsets = (np.arange(roi['width']) - (roi['width'] - 1) / 2)[:, None]
+    xs = x0 + t * (x1 - x0) + offsets * normal[0]
+    ys = y0 + t * (y1 - y0) + offsets * normal[1]
+    return np.rint(ys).astype(np.intp), np.rint(xs).astype(np.intp)
+
+
+def open_tiff(path):
+    # Memory-map when the pixel data is stored uncompressed, otherwise fall back to reading it
+    try:
+        return tifffile.memmap(path, mode='r')
+    except ValueError:
+        return tifffile.imread(path)
+
+
+def sample_line_profiles(image, rows, cols):
+    """Line profiles from one image (H, W[, C]) or a stack (T, H, W[, C]) as a (T, n_points) array."""
+    rgb = image.ndim >= 3 and image.shape[-1] in (3, 4)
+    height, width = image.shape[-3:-1] if rgb else image.shape[-2:]
+    if rows.min() < 0 or cols.min() < 0 or rows.max() >= height or cols.max() >= width:
+        raise ValueError(f"Line ROI falls outside the {width}x{height} image")
+    if rgb:
+        samples = image[..., rows, cols, :3].astype(np.float64) @ GRAY_WEIGHTS
+    else:
+        samples = image[..., rows, cols].astype(np.float64)
+    return np.atleast_2d(samples.mean(axis=-2))
+
+
+def extract_chip_profiles(folder, roi=None):
+    """(time, position) intensities along the line ROI for every timepoint image of a chip folder."""
+    if not TIFFFILE_AVAILABLE:
+        raise RuntimeError("TIFF extraction requires tifffile (pip install tifffile)")
+    roi = roi or load_line_roi(os.path.join(folder, ROI_FILENAME))
+    paths = list_timepoint_images(folder, roi)
+    if not paths:
+        raise ValueError(f"No timepoint TIFF images in {folder}")
+    rows, cols = line_sample_coords(roi)
+    return np.concatenate([sample_line_profiles(open_tiff(p), rows, cols) for p in paths])
+
+
+def find_chip_folders(directory):
+    """The directory itself if it holds TIFF images, otherwise its subfolders that do."""
+    if list_tiffs(directory):
+        return [directory]
+    subdirs = sorted((os.path.join(directory, d) for d in os.listdir(directory)
+                      if os.path.isdir(os.path.join(directory, d))), key=_natural_key)
+    return [d for d in subdirs if list_tiffs(d)]
+
+
+@instrumented
+def load_experiment_from_tiffs(folders, time_interval=0.25, roi=None, progress=None, normalization=None):
+    """One experiment with a replicate per chip folder, each sampled with its own roi.json unless roi is given."""
+    rois = [roi or load_line_roi(os.path.join(folder, ROI_FILENAME)) for folder in folders]
+    arrays = []
+    for i, (folder, r) in enumerate(zip(folders, rois)):
+        arrays.append(extract_chip_profiles(folder, r))
+        if progress is not None:
+            progress(i + 1, len(folders), os.path.basename(folder))
+    return ExperimentData(stack_profiles(arrays), time_interval, roi_spacing(rois[0]), folders, normalization)
+
+
+# Multi-chip extraction with a bounded number of frames in flight
+
+MANIFEST_FILENAME = 'extraction_manifest.json'
+SPACING_FILENAME = 'spacing.json'
+
+
+def list_frames(path):
+    """(path, page) work items for one TIFF; page is None for single images."""
+    with tifffile.TiffFile(path) as tif:
+        shape = tif.series[0].shape
+    rgb = len(shape) >= 3 and shape[-1] in (3, 4)
+    if len(shape) - rgb >= 3:
+        return [(path, page) for page in range(int(np.prod(shape[:-3 if rgb else -2])))]
+    return [(path, None)]
+
+
+def read_frame(path, page=None):
+    try:
+        image = tifffile.memmap(path, mode='r')
+        if page is not None:
+            frame_ndim = 3 if image.shape[-1] in (3, 4) else 2
+            image = image.reshape((-1,) + image.shape[-frame_ndim:])[page]
+        return image
+    except ValueError:
+        return tifffile.imread(path, key=page or 0)
+
+
+def _extract_frame(path, page, rows, cols):
+    return sample_line_profiles(read_frame(path, page), rows, cols)[0]
+
+
+def _chip_fingerprint(folder, roi):
+    h = hashlib.sha1(json.dumps(roi, sort_keys=True).encode())
+    for path in list_timepoint_images(folder, roi):
+        st = os.stat(path)
+        h.update(f"{os.path.basename(path)}|{st.st_size}|{st.st_mtime_ns}".encode())
+    return h.hexdigest()
+
+
+def _write_json(path, manifest):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def _record_spacing(output, spacing):
+    # spacing.json next to the extracted .txt files maps each file name to its µm between points; chips whose
+    # ROI has no pixel size are left out, so the spacing given at analysis time applies to them
+    path = os.path.join(os.path.dirname(output), SPACING_FILENAME)
+    records = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            records = json.load(f)
+    name = os.path.basename(output)
+    if spacing is not None:
+        records[name] = spacing
+    elif records.pop(name, None) is None:
+        return
+    _write_json(path, records)
+
+
+def recorded_spacings(file_paths):
+    """µm between points of each extracted .txt file as recorded by extract_chips, None where not recorded."""
+    records = {}
+    spacings = []
+    for path in file_paths:
+        directory = os.path.dirname(os.path.abspath(path))
+        if directory not in records:
+            sidecar = os.path.join(directory, SPACING_FILENAME)
+            records[directory] = {}
+            if os.path.exists(sidecar):
+                with open(sidecar) as f:
+                    records[directory] = json.load(f)
+        spacings.append(records[directory].get(os.path.basename(path)))
+    return spacings
+
+
+def find_roi_chip_folders(root_dir):
+    """Every folder under root_dir with timepoint TIFF images and a saved line ROI."""
+    return [dirpath for dirpath, dirnames, filenames in sorted(os.walk(root_dir))
+            if ROI_FILENAME in filenames and any(f.lower().endswith(TIFF_EXTENSIONS) for f in filenames)]
+
+
+@instrumented
+def extract_chips(chip_folders, output_dir, workers=None, max_pending=None, root_dir=None, log=print):
+    """Extract line profiles for many chips in parallel and write one .txt per chip (the process_files layout).
+
+    Chip folders keep their place under root_dir: campaign/exp1/chip 5.1 is written to output_dir/exp1/chip
+    5.1.txt, so --batch and ExperimentStore see the chips of each experiment folder as its replicates. Without
+    root_dir every chip goes directly into output_dir, as one experiment. The µm between points of chips whose
+    ROI has a pixel size is recorded in spacing.json next to their .txt (see recorded_spacings), as the .txt
+    itself only holds intensities.
+
+    Frames from all chips are interleaved over a process pool, with at most max_pending frames submitted at a
+    time; workers sample the ROI from memory-mapped images and send back only the profile row. Finished chips
+    are recorded in extraction_manifest.json in output_dir and skipped on the next run unless their images or
+    ROI changed. A chip that cannot be extracted (no timepoint images, a frame that fails to read or lies
+    outside the ROI) is logged, left out of the manifest and skipped, and the other chips carry on.
+    Returns {chip folder: {'output', 'frames', 'seconds', 'frames_per_s'}, or the exception if it failed}.
+    """
+    from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+    if not TIFFFILE_AVAILABLE:
+        raise RuntimeError("TIFF extraction requires tifffile (pip install tifffile)")
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST_FILENAME)
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    workers = workers or os.cpu_count() or 1
+    max_pending = max_pending or 2 * workers
+
+    results = {}
+
+    def fail(key, folder, error, where=''):
+        results[key] = error
+        log(f"{folder}: failed: {where}{error}")
+        if manifest.pop(key, None) is not None:
+            _write_json(manifest_path, manifest)
+
+    chips = {}
+    for folder in chip_folders:
+        key = os.path.abspath(folder)
+        rel = os.path.relpath(folder, root_dir) if root_dir else '.'
+        if rel == '.':
+            rel = os.path.basename(os.path.abspath(folder))
+        output = os.path.join(output_dir, rel + '.txt')
+        try:
+            roi = load_line_roi(os.path.join(folder, ROI_FILENAME))
+            fingerprint = _chip_fingerprint(folder, roi)
+            entry = manifest.get(key, {})
+            if (entry.get('fingerprint') == fingerprint and entry.get('output') == output
+                    and os.path.exists(output)):
+                log(f"{folder}: already extracted, skipping")
+                continue
+            frames = [item for path in list_timepoint_images(folder, roi) for item in list_frames(path)]
+            if not frames:
+                raise ValueError(f"No timepoint TIFF images in {folder}")
+        except Exception as e:
+            fail(key, folder, e)
+            continue
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+        chips[key] = {
+            'folder': folder,
+            'coords': line_sample_coords(roi),
+            'frames': frames,
+            'fingerprint': fingerprint,
+            'output': output,
+            'spacing': roi_spacing(roi) if roi.get('um_per_pixel') else None,
+            'profiles': np.empty((len(frames), roi['n_points'])),
+            'remaining': len(frames),
+            'start': None,
+        }
+
+    # Round-robin over chips so every chip progresses and finishes independently
+    tasks = []
+    longest = max((len(c['frames']) for c in chips.values()), default=0)
+    for i in range(longest):
+        tasks += [(key, i) for key, chip in chips.items() if i < len(chip['frames'])]
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = {}
+        tasks = iter(tasks)
+        while True:
+            for key, i in tasks:
+                chip = chips[key]
+                if key in results:
+                    continue  # failed
+                if chip['start'] is None:
+                    chip['start'] = time.perf_counter()
+                path, page = chip['frames'][i]
+                pending[pool.submit(_extract_frame, path, page, *chip['coords'])] = (key, i)
+                if len(pending) >= max_pending:
+                    break
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                key, i = pending.pop(future)
+                chip = chips[key]
+                if key in results:
+                    continue
+                try:
+                    chip['profiles'][i] = future.result()
+                except Exception as e:
+                    chip['profiles'] = None
+                    fail(key, chip['folder'], e, f"{os.path.basename(chip['frames'][i][0])}: ")
+                    continue
+                chip['remaining'] -= 1
+                if chip['remaining']:
+                    continue
+                np.savetxt(chip['output'], chip['profiles'], fmt='%.10g', delimiter=',')
+                _record_spacing(chip['output'], chip['spacing'])
+                seconds = time.perf_counter() - chip['start']
+                results[key] = {'output': chip['output'], 'frames': len(chip['frames']), 'seconds': seconds,
+                                'frames_per_s': len(chip['frames']) / seconds if seconds else float('inf')}
+                manifest[key] = dict(results[key], fingerprint=chip['fingerprint'])
+                _write_json(manifest_path, manifest)
+                chip['profiles'] = None
+                log(f"{chip['folder']}: {len(chip['frames'])} frames in {seconds:.2f} s "
+                    f"({results[key]['frames_per_s']:.1f} frames/s) -> {chip['output']}")
+    return results
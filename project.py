@@ -1,8 +1,11 @@
 import tkinter as tk
-from tkinter import filedialog, messagebox
+from tkinter import filedialog, messagebox, simpledialog, ttk
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 import numpy as np
 import os
+import queue
+import threading
 
 try:
     from PIL import Image, ImageTk
@@ -10,13 +13,76 @@ try:
 except ImportError:
     PIL_AVAILABLE = False
 
+from diffusion_analysis.batch import run_batch
+from diffusion_analysis.data import (NORMALIZATION_SCOPES, POSITION_SPACING_UM, SOURCE_SINK_ESTIMATORS, ProfileCache,
+                                     load_experiment, select_time_indices)
+from diffusion_analysis.diffusion import (SCIPY_AVAILABLE, build_diffusion_distance_figure,
+                                          build_diffusion_fit_figure, fit_diffusion, parse_float_list,
+                                          summarize_diffusion_distances, threshold_crossings,
+                                          write_diffusion_distance_txt, write_diffusion_fit_txt)
+from diffusion_analysis.live import LiveExperiment, TextFileSource, TiffFolderSource
+from diffusion_analysis.plotting import (ProfilePlotter, _new_figure, build_kinetics_figure,
+                                         build_source_sink_figure, build_time_series_figure)
+from diffusion_analysis.profiling import PROFILER, STAGE_COUNTERS, instrumented, json_lines_sink, summarize_stages
+from diffusion_analysis.store import (EXPERIMENT_METADATA, ExperimentStore, build_overlay_figure,
+                                      compare_time_series, condition_table, write_condition_table_txt)
+from diffusion_analysis.summary import (PARQUET_AVAILABLE, SUMMARY_WRITERS, summary_table, time_series_at_distance,
+                                        time_series_at_distances, write_summary_txt)
+from diffusion_analysis.tiff import (ROI_FILENAME, TIFFFILE_AVAILABLE, extract_chips, find_brightfield,
+                                     find_chip_folders, find_roi_chip_folders, load_experiment_from_tiffs, open_tiff,
+                                     save_line_roi)
+
+
+class TaskCancelled(Exception):
+    pass
+
+
+class BackgroundTask:
+    """Runs func(progress) on a daemon thread and posts progress/done/error/cancelled messages to a queue.
+
+    progress(done, total, message) raises TaskCancelled once cancel() was called, so long loops stop at the
+    next step. Only the Tk main thread reads the messages, which keeps all widget and canvas access there.
+    """
+
+    def __init__(self, func):
+        self.messages = queue.Queue()
+        self._cancelled = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(func,), daemon=True)
+        self._thread.start()
+
+    def progress(self, done, total, message=''):
+        if self._cancelled.is_set():
+            raise TaskCancelled()
+        self.messages.put(('progress', (done, total, message)))
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def _run(self, func):
+        try:
+            result = func(self.progress)
+        except TaskCancelled:
+            self.messages.put(('cancelled', None))
+        except Exception as e:
+            self.messages.put(('error', e))
+        else:
+            self.messages.put(('cancelled', None) if self._cancelled.is_set() else ('done', result))
+
+
 class FluorescenceAnalyzer:
     def __init__(self, root):
         self.root = root
         self.root.title("Fluorescence Analyzer")
         self.file_paths = []
-        self.time_groups = {}
-        self.selected_distance = tk.DoubleVar(value=0.0)
+        self.experiment = None
+        try:
+            self.profile_cache = ProfileCache()
+        except OSError:
+            self.profile_cache = None
+        self.selected_distance = tk.StringVar(value="0")
+        self.pixel_size = tk.DoubleVar(value=POSITION_SPACING_UM)
+        self.pixel_size.trace_add('write', self.relabel_distance_axis)
+        self.interpolate_distance = tk.BooleanVar(value=True)
         self.min_distance = tk.DoubleVar(value=0.0)
         self.max_distance = tk.DoubleVar(value=2000.0)
         self.use_max_distance = tk.BooleanVar(value=True)
@@ -24,6 +90,7 @@ class FluorescenceAnalyzer:
         self.max_time = tk.DoubleVar(value=30.0)
         self.use_max_time = tk.BooleanVar(value=True)
         self.time_interval = tk.DoubleVar(value=0.25)
+        self.time_interval.trace_add('write', self.relabel_time_axis)
         self.selected_interval = tk.StringVar(value="All")
         self.interval_map = {
             "All": None,
@@ -51,6 +118,28 @@ class FluorescenceAnalyzer:
         self.ss_show_grid = tk.BooleanVar(value=True)
         self.ss_font_size = tk.IntVar(value=12)
         self.show_std = tk.BooleanVar(value=True)
+        self.full_resolution_export = tk.BooleanVar(value=False)
+        self.store = None
+        self.ss_window = tk.StringVar(value="")
+        self.ss_estimator = tk.StringVar(value='mean')
+        self.ss_scope = tk.StringVar(value='line')
+        self.store_filter = tk.StringVar(value="")
+        self.profile_stages = tk.BooleanVar(value=False)
+        self.profile_memory = tk.BooleanVar(value=False)
+        self.stage_window = None
+        self.std_ddof = tk.IntVar(value=1)
+        self.live_poll_seconds = tk.DoubleVar(value=5.0)
+        self._live_job = None
+        self.live_view = None
+        self.dd_thresholds = tk.StringVar(value="50, 10")
+        self.last_distance_summary = None
+        self.last_fit = None
+        self.task = None
+        self.status = tk.StringVar(value="Ready")
+        self.figure = Figure(figsize=(8, 8))
+        self.last_fig = None
+        self.profile_plotter = None
+        self._profile_layout = None
         self._setup_gui()
 
     def _setup_gui(self):
@@ -66,8 +155,23 @@ class FluorescenceAnalyzer:
             tk.Label(img_frame, image=self.tk_img).pack(pady=10)
         else:
             tk.Label(img_frame, text="Fluorescence Analyzer", font=('Arial', 16)).pack(pady=20)
-        main_frame.columnconfigure(0, weight=1)
+        # Plots are drawn into one embedded figure, reused for every plot
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
+        plot_frame = tk.Frame(main_frame)
+        plot_frame.grid(row=0, column=2, sticky="nsew")
+        self.canvas = FigureCanvasTkAgg(self.figure, master=plot_frame)
+        NavigationToolbar2Tk(self.canvas, plot_frame).update()
+        self.canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+        status_frame = tk.Frame(main_frame)
+        status_frame.grid(row=1, column=0, columnspan=3, sticky="ew", padx=10, pady=5)
+        self.progress_bar = ttk.Progressbar(status_frame, length=200, mode='determinate')
+        self.progress_bar.pack(side=tk.LEFT)
+        tk.Button(status_frame, text="Cancel", command=self.cancel_task).pack(side=tk.LEFT, padx=5)
+        tk.Label(status_frame, textvariable=self.status, anchor="w").pack(side=tk.LEFT, fill=tk.X, expand=True)
+        main_frame.columnconfigure(0, weight=0)
         main_frame.columnconfigure(1, weight=0)
+        main_frame.columnconfigure(2, weight=1)
+        main_frame.rowconfigure(0, weight=1)
         self._create_controls(controls_frame)
 
     def _create_controls(self, parent):
@@ -110,19 +214,34 @@ class FluorescenceAnalyzer:
         std_frame.pack(padx=10, pady=5, fill=tk.X)
         tk.Label(std_frame, text="Standard Deviation Display:").pack(side=tk.LEFT)
         tk.Checkbutton(std_frame, text="Show STD", variable=self.show_std).pack(side=tk.LEFT)
+        tk.Radiobutton(std_frame, text="Sample (n-1)", variable=self.std_ddof, value=1).pack(side=tk.LEFT, padx=3)
+        tk.Radiobutton(std_frame, text="Population (n)", variable=self.std_ddof, value=0).pack(side=tk.LEFT, padx=3)
 
         # Load Button
         file_frame = tk.Frame(parent)
         file_frame.pack(padx=10, pady=10, fill=tk.X)
-        tk.Button(file_frame, text="Load Experiment Replicates", command=self.load_files).pack(pady=5)
+        tk.Button(file_frame, text="Load Experiment Replicates", command=self.load_files).pack(side=tk.LEFT, padx=5, pady=5)
+        tk.Button(file_frame, text="Load TIFF Chip Folders", command=self.load_tiff_folders).pack(side=tk.LEFT, padx=5, pady=5)
+        tk.Button(file_frame, text="Define Line ROI", command=self.define_line_roi).pack(side=tk.LEFT, padx=5, pady=5)
+        live_frame = tk.Frame(parent)
+        live_frame.pack(padx=10, fill=tk.X)
+        tk.Label(live_frame, text="Live acquisition:").pack(side=tk.LEFT)
+        tk.Button(live_frame, text="Watch Files", command=self.start_live_files).pack(side=tk.LEFT, padx=5)
+        tk.Button(live_frame, text="Watch TIFF Folders", command=self.start_live_tiff).pack(side=tk.LEFT, padx=5)
+        tk.Button(live_frame, text="Stop", command=self.stop_live).pack(side=tk.LEFT, padx=5)
+        tk.Label(live_frame, text="Poll every (s):").pack(side=tk.LEFT)
+        tk.Entry(live_frame, textvariable=self.live_poll_seconds, width=5).pack(side=tk.LEFT)
 
         # Distance Controls
         distance_frame = tk.LabelFrame(parent, text="Distance Controls")
         distance_frame.pack(padx=10, pady=5, fill=tk.X)
         dist_select_frame = tk.Frame(distance_frame)
         dist_select_frame.pack(pady=2, fill=tk.X)
-        tk.Label(dist_select_frame, text="Distance to check (µm):").pack(side=tk.LEFT)
-        tk.Entry(dist_select_frame, textvariable=self.selected_distance, width=10).pack(side=tk.LEFT, padx=5)
+        tk.Label(dist_select_frame, text="Distance(s) to check (µm):").pack(side=tk.LEFT)
+        tk.Entry(dist_select_frame, textvariable=self.selected_distance, width=16).pack(side=tk.LEFT, padx=5)
+        tk.Checkbutton(dist_select_frame, text="Interpolate", variable=self.interpolate_distance).pack(side=tk.LEFT)
+        tk.Label(dist_select_frame, text="Pixel size (µm):").pack(side=tk.LEFT)
+        tk.Entry(dist_select_frame, textvariable=self.pixel_size, width=6).pack(side=tk.LEFT, padx=5)
         dist_range_frame = tk.Frame(distance_frame)
         dist_range_frame.pack(pady=2, fill=tk.X)
         tk.Label(dist_range_frame, text="Min distance (µm):").pack(side=tk.LEFT)
@@ -133,6 +252,43 @@ class FluorescenceAnalyzer:
         tk.Checkbutton(dist_range_frame, text="Use max in data", variable=self.use_max_distance,
                        command=self.toggle_max_distance).pack(side=tk.LEFT, padx=5)
 
+        # Diffusion Distance
+        dd_frame = tk.LabelFrame(parent, text="Diffusion Distance")
+        dd_frame.pack(padx=10, pady=5, fill=tk.X)
+        tk.Label(dd_frame, text="Thresholds (%):").pack(side=tk.LEFT)
+        tk.Entry(dd_frame, textvariable=self.dd_thresholds, width=12).pack(side=tk.LEFT, padx=5)
+        tk.Button(dd_frame, text="Plot Diffusion Distance", command=self.plot_diffusion_distance).pack(side=tk.LEFT, padx=5)
+        tk.Button(dd_frame, text="Export Distances", command=self.export_diffusion_distance_dialog).pack(side=tk.LEFT, padx=5)
+        tk.Button(dd_frame, text="Fit D", command=self.plot_diffusion_fit).pack(side=tk.LEFT, padx=5)
+        tk.Button(dd_frame, text="Export Fit", command=self.export_diffusion_fit_dialog).pack(side=tk.LEFT, padx=5)
+
+        # Source/sink normalization
+        norm_frame = tk.LabelFrame(parent, text="Source/Sink Normalization")
+        norm_frame.pack(padx=10, pady=5, fill=tk.X)
+        tk.Label(norm_frame, text="Window (µm, blank = 5 points):").pack(side=tk.LEFT)
+        tk.Entry(norm_frame, textvariable=self.ss_window, width=6).pack(side=tk.LEFT, padx=5)
+        tk.Label(norm_frame, text="Estimator:").pack(side=tk.LEFT)
+        tk.OptionMenu(norm_frame, self.ss_estimator, *SOURCE_SINK_ESTIMATORS).pack(side=tk.LEFT)
+        tk.Label(norm_frame, text="Reference:").pack(side=tk.LEFT)
+        tk.OptionMenu(norm_frame, self.ss_scope, *NORMALIZATION_SCOPES).pack(side=tk.LEFT)
+        tk.Button(norm_frame, text="Apply", command=self.apply_normalization).pack(side=tk.LEFT, padx=5)
+
+        # Experiment comparison
+        store_frame = tk.LabelFrame(parent, text="Compare Experiments")
+        store_frame.pack(padx=10, pady=5, fill=tk.X)
+        store_buttons = tk.Frame(store_frame)
+        store_buttons.pack(fill=tk.X)
+        tk.Button(store_buttons, text="Add Folder", command=self.add_store_folder).pack(side=tk.LEFT, padx=5)
+        tk.Label(store_buttons, text="Filter (e.g. kda=4, ratio=50-50):").pack(side=tk.LEFT)
+        filter_entry = tk.Entry(store_buttons, textvariable=self.store_filter, width=20)
+        filter_entry.pack(side=tk.LEFT, padx=5)
+        filter_entry.bind('<Return>', lambda event: self.refresh_store_list())
+        tk.Button(store_buttons, text="Overlay", command=self.plot_store_overlay).pack(side=tk.LEFT, padx=5)
+        tk.Button(store_buttons, text="Open", command=self.open_store_experiment).pack(side=tk.LEFT, padx=5)
+        tk.Button(store_buttons, text="Export Table", command=self.export_store_table).pack(side=tk.LEFT, padx=5)
+        self.store_list = tk.Listbox(store_frame, selectmode=tk.EXTENDED, height=5)
+        self.store_list.pack(fill=tk.X, padx=5, pady=2)
+
         # Plot Customization
         custom_frame = tk.LabelFrame(parent, text="Main Plot Customization")
         custom_frame.pack(padx=10, pady=2, fill=tk.X)
@@ -145,6 +301,7 @@ class FluorescenceAnalyzer:
         tk.Checkbutton(custom_frame, text="Show grid", variable=self.show_grid).pack(side=tk.LEFT)
         tk.Label(custom_frame, text="Font size:").pack(side=tk.LEFT)
         tk.Entry(custom_frame, textvariable=self.font_size, width=4).pack(side=tk.LEFT)
+        tk.Checkbutton(custom_frame, text="Full resolution SVG", variable=self.full_resolution_export).pack(side=tk.LEFT)
 
         # Control Buttons
         button_frame = tk.Frame(parent)
@@ -154,58 +311,482 @@ class FluorescenceAnalyzer:
         tk.Button(button_frame, text="Plot Source/Sink", command=self.plot_source_sink).pack(side=tk.LEFT, padx=5)
         tk.Button(button_frame, text="Export", command=self.export_plot_dialog).pack(side=tk.LEFT, padx=5)
 
+        # Instrumentation
+        profile_frame = tk.LabelFrame(parent, text="Instrumentation")
+        profile_frame.pack(padx=10, pady=5, fill=tk.X)
+        tk.Checkbutton(profile_frame, text="Record stage timings", variable=self.profile_stages,
+                       command=self.toggle_profiling).pack(side=tk.LEFT)
+        tk.Checkbutton(profile_frame, text="Track memory (slower)", variable=self.profile_memory,
+                       command=self.toggle_profiling).pack(side=tk.LEFT)
+        tk.Button(profile_frame, text="Show Timings", command=self.show_stage_summary).pack(side=tk.LEFT, padx=5)
+        tk.Button(profile_frame, text="Clear", command=self.clear_stage_summary).pack(side=tk.LEFT, padx=5)
+
+    def add_store_folder(self):
+        directory = filedialog.askdirectory(title="Folder with experiments (searched recursively)")
+        if not directory:
+            return
+        try:
+            time_interval = float(self.time_interval.get())
+            pixel_size = float(self.pixel_size.get())
+        except (ValueError, tk.TclError):
+            time_interval, pixel_size = 0.25, POSITION_SPACING_UM
+        if self.store is None:
+            self.store = ExperimentStore(time_interval, pixel_size, cache=self.profile_cache,
+                                         normalization=self.normalization_settings())
+        elif (self.store.time_interval, self.store.spacing) != (time_interval, pixel_size):
+            self.store.time_interval, self.store.spacing = time_interval, pixel_size
+            self.store.release()
+        if not self.store.add_folder(directory):
+            messagebox.showwarning("Compare Experiments", "No .txt replicates found.")
+        self.refresh_store_list()
+
+    def store_criteria(self):
+        criteria = {}
+        for item in self.store_filter.get().split(','):
+            key, _, value = item.partition('=')
+            key, value = key.strip().lower(), value.strip()
+            if key in ('kda', 'duration_h'):
+                criteria[key] = float(value.lower().rstrip('kdah'))
+            elif key in EXPERIMENT_METADATA:
+                criteria[key] = value
+        return criteria
+
+    def refresh_store_list(self):
+        self.store_list.delete(0, tk.END)
+        if self.store is None:
+            return
+        try:
+            keys = self.store.select(**self.store_criteria())
+        except ValueError:
+            keys = list(self.store.entries)
+        for key in keys:
+            self.store_list.insert(tk.END, key)
+
+    def selected_store_keys(self):
+        keys = [self.store_list.get(i) for i in self.store_list.curselection()]
+        if not keys and self.store is not None:
+            keys = list(self.store_list.get(0, tk.END))
+        return keys
+
+    def plot_store_overlay(self):
+        keys = self.selected_store_keys()
+        if not keys:
+            messagebox.showinfo("No Data", "Add a folder of experiments first")
+            return
+        try:
+            distance = (parse_float_list(self.selected_distance.get()) or [0.0])[0]
+        except ValueError:
+            distance = 0.0
+        store = self.store
+        interval = self.interval_map[self.selected_interval.get()]
+        interpolate = self.interpolate_distance.get()
+        ddof = self.std_ddof.get()
+
+        def compare(progress):
+            series = {}
+            for i, key in enumerate(keys):
+                series.update(compare_time_series(store, [key], distance, interval, interpolate, ddof))
+                progress(i + 1, len(keys), key)
+            return series
+
+        self.run_task("Comparing experiments", compare, lambda series: self.show_overlay(series, distance))
+
+    @instrumented
+    def show_overlay(self, series, distance):
+        self.last_fig = build_overlay_figure(
+            series, distance, line_style=self.ts_line_style.get(), marker=self.ts_marker_style.get(),
+            show_std=self.show_std.get(), show_grid=self.ts_show_grid.get(), font_size=self.ts_font_size.get(),
+            cmap=self.ts_data_cmap.get(), fig=self.figure)
+        self.show_figure(self.last_fig)
+
+    def open_store_experiment(self):
+        keys = [self.store_list.get(i) for i in self.store_list.curselection()]
+        if len(keys) != 1:
+            messagebox.showinfo("Compare Experiments", "Select one experiment to open")
+            return
+        self.file_paths = self.store.entries[keys[0]]['files']
+        self.process_files(self.file_paths)
+
+    def export_store_table(self):
+        keys = self.selected_store_keys()
+        if not keys:
+            messagebox.showinfo("No Data", "Add a folder of experiments first")
+            return
+        file_path = filedialog.asksaveasfilename(defaultextension=".txt", filetypes=[("Text file", "*.txt")])
+        if not file_path:
+            return
+        try:
+            threshold = parse_float_list(self.dd_thresholds.get())[0]
+        except (ValueError, IndexError):
+            threshold = 50.0
+        store = self.store
+        ddof = self.std_ddof.get()
+
+        def tabulate(progress):
+            rows = []
+            for i, key in enumerate(keys):
+                rows += condition_table(store, [key], threshold, ddof)
+                progress(i + 1, len(keys), key)
+            write_condition_table_txt(rows, file_path)
+            return file_path
+
+        self.run_task("Tabulating experiments", tabulate,
+                      lambda path: messagebox.showinfo("Export", f"Comparison table exported as TXT:\n{path}"))
+
+    def toggle_profiling(self):
+        PROFILER.configure(self.profile_stages.get(), self.profile_memory.get())
+
+    def show_stage_summary(self):
+        if self.stage_window is None or not self.stage_window.winfo_exists():
+            self.stage_window = tk.Toplevel(self.root)
+            self.stage_window.title("Stage Timings")
+            columns = ('calls', 'total_ms', 'max_ms', 'peak_mb') + STAGE_COUNTERS
+            tree = ttk.Treeview(self.stage_window, columns=columns, height=20)
+            tree.heading('#0', text='stage')
+            tree.column('#0', width=320)
+            for column in columns:
+                tree.heading(column, text=column)
+                tree.column(column, width=80, anchor='e')
+            tree.pack(fill=tk.BOTH, expand=True)
+            tk.Button(self.stage_window, text="Refresh", command=self.show_stage_summary).pack(pady=5)
+            self.stage_tree = tree
+        tree = self.stage_tree
+        tree.delete(*tree.get_children())
+        for row in summarize_stages(PROFILER.records):
+            peak = '' if row['peak_bytes'] is None else f"{row['peak_bytes'] / 1e6:.1f}"
+            tree.insert('', tk.END, text=row['stage'], values=(
+                row['calls'], f"{row['seconds'] * 1000:.1f}", f"{row['max_seconds'] * 1000:.1f}", peak,
+                *(row.get(key, '') for key in STAGE_COUNTERS)))
+
+    def clear_stage_summary(self):
+        PROFILER.clear()
+        if self.stage_window is not None and self.stage_window.winfo_exists():
+            self.show_stage_summary()
+
     def toggle_max_distance(self):
         self.max_distance_entry.config(state="disabled" if self.use_max_distance.get() else "normal")
 
     def toggle_max_time(self):
         self.max_time_entry.config(state="disabled" if self.use_max_time.get() else "normal")
 
+    def run_task(self, label, func, on_done):
+        # func(progress) runs on a worker thread; on_done(result) runs back on the Tk thread
+        if self.task is not None:
+            self.task.cancel()
+        self.task = BackgroundTask(func)
+        self.progress_bar.config(value=0, maximum=1)
+        self.status.set(f"{label}...")
+        self.root.after(50, self._poll_task, self.task, label, on_done)
+
+    def _poll_task(self, task, label, on_done):
+        if task is not self.task:
+            return
+        while True:
+            try:
+                kind, payload = task.messages.get_nowait()
+            except queue.Empty:
+                break
+            if kind == 'progress':
+                done, total, message = payload
+                self.progress_bar.config(value=done, maximum=max(total, 1))
+                self.status.set(f"{label} {done}/{total} {message}")
+                continue
+            self.task = None
+            if kind == 'done':
+                self.status.set(f"{label} done")
+                on_done(payload)
+            elif kind == 'error':
+                self.status.set(f"{label} failed")
+                messagebox.showerror(label, str(payload))
+            else:
+                self.status.set(f"{label} cancelled")
+                self.progress_bar.config(value=0)
+            return
+        self.root.after(50, self._poll_task, task, label, on_done)
+
+    def cancel_task(self):
+        if self.task is not None:
+            self.task.cancel()
+
+    def show_figure(self, fig):
+        # Another plot took over the figure, so the profile plot has to be rebuilt next time
+        self.profile_plotter = None
+        self.last_fig = fig
+        self.redraw()
+
+    def redraw(self):
+        # Drawing normally waits for Tk to be idle; when timing stages it happens now so it can be measured
+        if PROFILER.enabled:
+            with PROFILER.stage('render'):
+                self.canvas.draw()
+        else:
+            self.canvas.draw_idle()
+
     def load_files(self):
         self.file_paths = filedialog.askopenfilenames(filetypes=[("Text files", "*.txt")])
         if self.file_paths:
             self.process_files(self.file_paths)
+
+    def load_tiff_folders(self):
+        if not TIFFFILE_AVAILABLE:
+            messagebox.showerror("TIFF", "Reading TIFF images requires tifffile (pip install tifffile)")
+            return
+        directory = filedialog.askdirectory(title="Chip folder, or a folder of chip folders")
+        if not directory:
+            return
+        folders = find_chip_folders(directory)
+        missing = [f for f in folders if not os.path.exists(os.path.join(f, ROI_FILENAME))]
+        if not folders or missing:
+            messagebox.showwarning("TIFF", "No TIFF images found." if not folders else
+                                   "Define a line ROI first for:\n" + "\n".join(missing))
+            return
+        try:
+            time_interval = float(self.time_interval.get())
+        except (ValueError, tk.TclError):
+            time_interval = 0.25
+        self.stop_live()
+        ddof = self.std_ddof.get()
+        normalization = self.normalization_settings()
+
+        def load(progress):
+            with PROFILER.stage('load_tiff_folders'):
+                exp = load_experiment_from_tiffs(folders, time_interval, progress=progress,
+                                                 normalization=normalization)
+                exp.stats(ddof)
+            return exp
+
+        def loaded(exp):
+            self.file_paths = folders
+            self.set_experiment(exp)
+            self.pixel_size.set(exp.spacing)
             self.plot_data()
 
-    def process_files(self, file_paths):
-        self.time_groups = {}
+        self.run_task("Extracting TIFF profiles", load, loaded)
+
+    def define_line_roi(self):
+        folder = filedialog.askdirectory(title="Chip folder with the brightfield image")
+        if not folder or not TIFFFILE_AVAILABLE:
+            return
+        brightfield = find_brightfield(folder)
+        if brightfield is None:
+            messagebox.showwarning("ROI", "No TIFF images found in this folder.")
+            return
+        n_points = simpledialog.askinteger("Line ROI", "Number of data points", initialvalue=200, minvalue=2)
+        width = simpledialog.askinteger("Line ROI", "Line width (pixels averaged)", initialvalue=1, minvalue=1)
+        um_per_pixel = simpledialog.askfloat("Line ROI", "Pixel size (µm/pixel, cancel if unknown)")
+        if not n_points or not width:
+            return
+        fig, ax = plt.subplots(figsize=(10, 8))
+        ax.imshow(np.asarray(open_tiff(brightfield)), cmap='gray')
+        ax.set_title("Click the start (source side) and end of the line")
+        points = fig.ginput(2, timeout=0)
+        plt.close(fig)
+        if len(points) == 2:
+            save_line_roi(os.path.join(folder, ROI_FILENAME), points[0], points[1], n_points, width, um_per_pixel,
+                          os.path.basename(brightfield))
+            messagebox.showinfo("ROI", f"Line ROI saved in {folder}")
+
+    def start_live_files(self):
+        paths = filedialog.askopenfilenames(filetypes=[("Text files", "*.txt")])
+        if paths:
+            self._start_live([TextFileSource(p) for p in paths])
+
+    def start_live_tiff(self):
+        if not TIFFFILE_AVAILABLE:
+            messagebox.showerror("TIFF", "Reading TIFF images requires tifffile (pip install tifffile)")
+            return
+        directory = filedialog.askdirectory(title="Chip folder, or a folder of chip folders")
+        if not directory:
+            return
+        folders = [f for f in find_chip_folders(directory) if os.path.exists(os.path.join(f, ROI_FILENAME))]
+        if not folders:
+            messagebox.showwarning("TIFF", "No chip folder with TIFF images and a line ROI found.")
+            return
+        self._start_live([TiffFolderSource(f) for f in folders])
+
+    def _start_live(self, sources):
+        self.stop_live()
         try:
             time_interval = float(self.time_interval.get())
+            pixel_size = float(self.pixel_size.get())
+        except (ValueError, tk.TclError):
+            time_interval, pixel_size = 0.25, POSITION_SPACING_UM
+        self.set_experiment(LiveExperiment(sources, time_interval, pixel_size,
+                                           normalization=self.normalization_settings()))
+        self.file_paths = self.experiment.file_paths
+        self.live_view = None
+        self._poll_live()
+
+    def stop_live(self):
+        if self._live_job is not None:
+            self.root.after_cancel(self._live_job)
+            self._live_job = None
+
+    def _poll_live(self):
+        # Errors are shown and polling goes on: a file may be fixed, or a half-written image complete, later
+        try:
+            changed = self.experiment.poll()
+            errors = self.experiment.source_errors
+            if changed is not None:
+                self.update_live_view(*changed)
+        except Exception as e:
+            errors = [e]
+        if errors:
+            self.status.set("Live: " + "; ".join(str(e) for e in errors))
+        try:
+            delay = max(0.1, float(self.live_poll_seconds.get()))
+        except (ValueError, tk.TclError):
+            delay = 5.0
+        self._live_job = self.root.after(int(delay * 1000), self._poll_live)
+
+    @instrumented
+    def update_live_view(self, start, stop):
+        # Adds or updates only the timepoints start:stop; earlier lines are left untouched
+        exp = self.experiment
+        view = self.live_view
+        if view is None or self.last_fig is not view['fig']:
+            fig = _new_figure(self.figure, None)
+            ax1, ax2, ax3 = fig.subplots(3, 1)
+            ax1.set_title('Normalized Profiles (live)')
+            ax1.set_xlabel('Distance (µm)')
+            ax1.set_ylabel('Normalized Intensity (%)')
+            ax1.set_ylim(-10, 110)
+            source_line, = ax2.plot([], [], color='blue', label='Source')
+            sink_line, = ax2.plot([], [], color='red', label='Sink')
+            ax2.set_ylabel('Fluorescence (a.u.)')
+            ax2.legend()
+            front_line, = ax3.plot([], [], color='black', marker='o')
+            ax3.set_xlabel('Time (hours)')
+            ax3.set_ylabel('Diffusion front (µm)')
+            for ax in (ax1, ax2, ax3):
+                ax.grid(True)
+            view = self.live_view = {'fig': fig, 'axes': (ax1, ax2, ax3), 'profiles': {}, 'front': {},
+                                     'source': source_line, 'sink': sink_line, 'front_line': front_line}
+            start = 0
+            fig.tight_layout()
+            self.show_figure(fig)
+        try:
+            threshold = parse_float_list(self.dd_thresholds.get())[0]
+        except (ValueError, IndexError):
+            threshold = 50.0
+        stats = exp.stats(self.std_ddof.get())
+        ax1, ax2, ax3 = view['axes']
+        latest = view['profiles'].get(max(view['profiles'], default=None))
+        if latest is not None:
+            latest.set_color('lightgray')
+        for t in range(start, stop):
+            mean = stats.normalized['mean'][t]
+            if t in view['profiles']:
+                view['profiles'][t].set_ydata(mean)
+            else:
+                view['profiles'][t], = ax1.plot(exp.distances, mean, color='lightgray', linewidth=1)
+            view['front'][t] = threshold_crossings(mean, exp.distances, threshold)
+        view['profiles'][stop - 1].set_color('tab:green')
+        times = exp.times
+        view['source'].set_data(times, stats.source['mean'])
+        view['sink'].set_data(times, stats.sink['mean'])
+        view['front_line'].set_data(times[list(view['front'])], list(view['front'].values()))
+        ax3.set_title(f'{threshold:g}% front')
+        for ax in (ax1, ax2, ax3):
+            ax.relim()
+            ax.autoscale_view()
+        ax1.set_ylim(-10, 110)
+        self.redraw()
+
+    def set_experiment(self, exp):
+        self.experiment = exp
+        self.last_fit = None
+        self.last_distance_summary = None
+        self.profile_plotter = None
+
+    def normalization_settings(self):
+        try:
+            window = self.ss_window.get().strip()
+            window_um = float(window) if window else None
         except ValueError:
+            messagebox.showwarning("Normalization", "The window must be a width in µm, or blank")
+            return None
+        return {'window_um': window_um, 'estimator': self.ss_estimator.get(), 'scope': self.ss_scope.get()}
+
+    @instrumented
+    def apply_normalization(self):
+        settings = self.normalization_settings()
+        if settings is None:
+            return
+        if self.store is not None:
+            self.store.set_normalization(settings)
+        if self.experiment is None:
+            return
+        self.experiment.renormalize(**settings)
+        self.last_fit = None
+        self.last_distance_summary = None
+        self.plot_data()
+
+    def process_files(self, file_paths):
+        self.stop_live()
+        try:
+            time_interval = float(self.time_interval.get())
+        except (ValueError, tk.TclError):
             time_interval = 0.25
             self.time_interval.set(time_interval)
+        try:
+            pixel_size = float(self.pixel_size.get())
+        except (ValueError, tk.TclError):
+            pixel_size = POSITION_SPACING_UM
+            self.pixel_size.set(pixel_size)
+        cache = self.profile_cache
+        ddof = self.std_ddof.get()
+        normalization = self.normalization_settings()
+
+        def load(progress):
+            with PROFILER.stage('process_files'):
+                exp = load_experiment(file_paths, time_interval, pixel_size, cache=cache, progress=progress,
+                                      normalization=normalization)
+                exp.stats(ddof)
+            return exp
+
+        def loaded(exp):
+            self.set_experiment(exp)
+            self.plot_data()
 
-        for file_path in file_paths:
-            with open(file_path, 'r') as file:
-                content = file.read().strip()
-                blocks = [b.strip() for b in content.split('\n') if b.strip()]
-                for idx, block in enumerate(blocks):  # Use per-file index
-                    values = list(map(float, block.split(',')))
-                    source = np.mean(values[:5])
-                    sink = np.mean(values[-5:])
-                    normalized = [(x - sink)/(source - sink)*100 for x in values]
-                    hours = idx * time_interval  # Time based on block position in file
-                    if hours not in self.time_groups:
-                        self.time_groups[hours] = []
-                    self.time_groups[hours].append({
-                        'distance': [i*10 for i in range(len(values))],
-                        'raw': values,
-                        'normalized': normalized,
-                        'source': source,
-                        'sink': sink
-                    })
+        self.run_task("Loading replicates", load, loaded)
+
+    def relabel_time_axis(self, *args):
+        # Times are derived from the interval, so no reparsing is needed
+        try:
+            time_interval = float(self.time_interval.get())
+        except (ValueError, tk.TclError):
+            return
+        if self.experiment is not None and time_interval > 0:
+            self.experiment.time_interval = time_interval
+            self.last_fit = None
+
+    def relabel_distance_axis(self, *args):
+        try:
+            pixel_size = float(self.pixel_size.get())
+        except (ValueError, tk.TclError):
+            return
+        if self.experiment is not None and pixel_size > 0:
+            self.experiment.spacing = pixel_size
+            if self.experiment.normalization['window_um'] is not None:
+                # The window is in µm, so it now covers a different number of points
+                self.experiment.renormalize()
+            self.last_fit = None
 
     def get_max_distance_from_data(self):
-        if not self.time_groups:
+        # A live experiment has no positions until its first timepoint arrives
+        if self.experiment is None or not self.experiment.distances.size:
             return 2000.0
-        return max(max(rep['distance']) for group in self.time_groups.values() for rep in group)
+        return float(self.experiment.distances[-1])
 
     def get_max_time_from_data(self):
-        if not self.time_groups:
+        if self.experiment is None or not self.experiment.times.size:
             return 30.0
-        return max(self.time_groups.keys())
+        return float(self.experiment.times[-1])
 
-    def plot_data(self):
-        if not self.time_groups:
+    @instrumented
+    def plot_data(self, full_resolution=False):
+        if self.experiment is None:
             return
 
         try:
@@ -222,205 +803,282 @@ class FluorescenceAnalyzer:
             max_time = self.get_max_time_from_data()
 
         interval = self.interval_map[self.selected_interval.get()]
-        filtered_times = [t for t in self.time_groups if min_time <= t <= max_time and
-                         (interval is None or abs((t / interval) - round(t / interval)) < 1e-6)]
-        filtered_times.sort()
+        filtered_times = select_time_indices(self.experiment, interval, min_time, max_time)
 
-        if not filtered_times:
+        if not len(filtered_times):
             messagebox.showinfo("No Data", "No data points match the selected criteria.")
             return
 
-        fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(13, 15))
-        cmap = plt.colormaps.get_cmap(self.data_cmap.get())
-        legend_handles = []
-        legend_labels = []
-
-        for idx, t in enumerate(filtered_times):
-            color = cmap(idx / max(1, len(filtered_times)-1))
-            group = self.time_groups[t]
-            distances = group[0]['distance']
-
-            # Plot raw data
-            if len(group) > 1 and self.show_std.get():
-                raw_mean = np.mean([rep['raw'] for rep in group], axis=0)
-                raw_std = np.std([rep['raw'] for rep in group], axis=0)
-                line, = ax1.plot(distances, raw_mean, color=color, linestyle=self.line_style.get())
-                ax1.fill_between(distances, raw_mean-raw_std, raw_mean+raw_std, color=color, alpha=0.2)
-            else:
-                for rep in group:
-                    line, = ax1.plot(rep['distance'], rep['raw'], color=color, linestyle=self.line_style.get())
-
-            # Plot normalized data
-            if len(group) > 1 and self.show_std.get():
-                norm_mean = np.mean([rep['normalized'] for rep in group], axis=0)
-                norm_std = np.std([rep['normalized'] for rep in group], axis=0)
-                line, = ax2.plot(distances, norm_mean, color=color, linestyle=self.line_style.get())
-                ax2.fill_between(distances, norm_mean-norm_std, norm_mean+norm_std, color=color, alpha=0.2)
-            else:
-                for rep in group:
-                    line, = ax2.plot(rep['distance'], rep['normalized'], color=color, linestyle=self.line_style.get())
-
-            # Add to legend
-            if abs(t % self.main_legend_interval.get()) < 1e-6:
-                legend_handles.append(line)
-                legend_labels.append(f'Time {t:.2f}h')
-
-        # Configure axes
-        ax1.set_xlim(min_dist, max_dist)
-        ax2.set_xlim(min_dist, max_dist)
-        ax1.set_title('Raw Fluorescence Data', fontsize=self.font_size.get())
-        ax1.set_ylabel('Fluorescence (a.u.)', fontsize=self.font_size.get())
-        ax1.grid(self.show_grid.get())
-        ax2.set_title('Normalized Fluorescence Data', fontsize=self.font_size.get())
-        ax2.set_xlabel('Distance (µm)', fontsize=self.font_size.get())
-        ax2.set_ylabel('Normalized Intensity (%)', fontsize=self.font_size.get())
-        ax2.set_ylim(-10, 110)
-        ax2.grid(self.show_grid.get())
-
-        # Add legend
-        if legend_handles:
-            legend = fig.legend(legend_handles, legend_labels, title='Time Points',
-                              loc='upper right', bbox_to_anchor=(0.95, 0.8),
-                              fontsize=self.font_size.get(), ncol=3)
-            for i, text in enumerate(legend.get_texts()):
-                text.set_color(legend_handles[i].get_color())
-
-        self.last_fig = fig
-        plt.tight_layout()
-        plt.subplots_adjust(right=0.85)
-        plt.show()
+        # The profile plot reuses its artists; the figure is only rebuilt after another plot replaced it
+        if self.profile_plotter is None:
+            self.profile_plotter = ProfilePlotter(_new_figure(self.figure, None))
+            self._profile_layout = None
+        font_size = self.font_size.get()
+        self.profile_plotter.update(
+            self.experiment, filtered_times, (min_dist, max_dist),
+            line_style=self.line_style.get(), cmap=self.data_cmap.get(), show_std=self.show_std.get(),
+            show_grid=self.show_grid.get(), font_size=font_size,
+            legend_interval=self.main_legend_interval.get(), ddof=self.std_ddof.get(),
+            layout=self._profile_layout != font_size, full_resolution=full_resolution)
+        self._profile_layout = font_size
+        self.last_fig = self.figure
+        with PROFILER.stage('render'):
+            self.profile_plotter.draw()
 
     def plot_time_series_button(self):
         try:
-            distance = float(self.selected_distance.get())
+            distances = parse_float_list(self.selected_distance.get()) or [0.0]
         except ValueError:
-            distance = 0.0
-        self.plot_time_series_at_distance(distance)
+            distances = [0.0]
+        if len(distances) == 1:
+            self.plot_time_series_at_distance(distances[0])
+        else:
+            self.plot_time_series_at_distances(distances)
 
+    @instrumented
     def plot_time_series_at_distance(self, distance):
-        interval = self.interval_map[self.selected_interval.get()]
-        times = []
-        raw_values = []
-        norm_values = []
-        raw_stds = []
-        norm_stds = []
-
-        for t in sorted(self.time_groups.keys()):
-            if interval and abs((t / interval) - round(t / interval)) >= 1e-6:
-                continue
+        series = None
+        if self.experiment is not None:
+            interval = self.interval_map[self.selected_interval.get()]
+            series = time_series_at_distance(self.experiment, distance,
+                                             select_time_indices(self.experiment, interval),
+                                             interpolate=self.interpolate_distance.get(),
+                                             ddof=self.std_ddof.get())
 
-            raw_group = []
-            norm_group = []
-            for rep in self.time_groups[t]:
-                distances = rep['distance']
-                idx = min(range(len(distances)), key=lambda i: abs(distances[i] - distance))
-                if abs(distances[idx] - distance) <= 5:
-                    raw_group.append(rep['raw'][idx])
-                    norm_group.append(rep['normalized'][idx])
-
-            if raw_group and norm_group:
-                times.append(t)
-                raw_values.append(np.mean(raw_group))
-                norm_values.append(np.mean(norm_group))
-                raw_stds.append(np.std(raw_group) if len(raw_group) > 1 else 0)
-                norm_stds.append(np.std(norm_group) if len(norm_group) > 1 else 0)
-
-        if not times:
+        if series is None:
             messagebox.showinfo("No Data", f"No data found at or near distance {distance}µm")
             return
 
-        fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(10, 8), sharex=True)
+        self.last_fig = build_time_series_figure(
+            series, distance, line_style=self.ts_line_style.get(), marker=self.ts_marker_style.get(),
+            show_std=self.show_std.get(), show_grid=self.ts_show_grid.get(), font_size=self.ts_font_size.get(),
+            fig=self.figure)
+        self.show_figure(self.last_fig)
 
-        # Raw values plot with std
-        ax1.errorbar(times, raw_values, yerr=raw_stds if self.show_std.get() else None,
-                    linestyle=self.ts_line_style.get(), color='blue', label='Raw Fluorescence',
-                    marker=self.ts_marker_style.get() if self.ts_marker_style.get() != 'None' else None)
-        ax1.set_ylabel('Fluorescence (a.u.)', fontsize=self.ts_font_size.get())
-        ax1.grid(self.ts_show_grid.get())
-        ax1.tick_params(labelsize=self.ts_font_size.get())
 
-        # Normalized values plot with std
-        ax2.errorbar(times, norm_values, yerr=norm_stds if self.show_std.get() else None,
-                    linestyle=self.ts_line_style.get(), color='green', label='Normalized Fluorescence',
-                    marker=self.ts_marker_style.get() if self.ts_marker_style.get() != 'None' else None)
-        ax2.set_xlabel('Time (hours)', fontsize=self.ts_font_size.get())
-        ax2.set_ylabel('Normalized (%)', fontsize=self.ts_font_size.get())
-        ax2.grid(self.ts_show_grid.get())
-        ax2.tick_params(labelsize=self.ts_font_size.get())
+    @instrumented
+    def plot_time_series_at_distances(self, distances):
+        if self.experiment is None:
+            messagebox.showinfo("No Data", "No data loaded to plot")
+            return
+        interval = self.interval_map[self.selected_interval.get()]
+        series = time_series_at_distances(self.experiment, distances,
+                                          select_time_indices(self.experiment, interval),
+                                          interpolate=self.interpolate_distance.get(), ddof=self.std_ddof.get())
+        self.last_fig = build_kinetics_figure(
+            series, line_style=self.ts_line_style.get(), marker=self.ts_marker_style.get(),
+            show_std=self.show_std.get(), show_grid=self.ts_show_grid.get(), font_size=self.ts_font_size.get(),
+            cmap=self.ts_data_cmap.get(), fig=self.figure)
+        self.show_figure(self.last_fig)
 
-        plt.suptitle(f'Fluorescence at {distance}µm', fontsize=self.ts_font_size.get())
-        plt.tight_layout()
-        self.last_fig = fig
-        plt.show()
+    @instrumented
+    def plot_source_sink(self):
+        if self.experiment is None:
+            messagebox.showinfo("No Data", "No data loaded to plot")
+            return
 
+        self.last_fig = build_source_sink_figure(
+            self.experiment, select_time_indices(self.experiment), line_style=self.ss_line_style.get(),
+            show_grid=self.ss_show_grid.get(), font_size=self.ss_font_size.get(), fig=self.figure)
+        self.show_figure(self.last_fig)
 
-    def plot_source_sink(self):
-        if not self.time_groups:
+    def compute_diffusion_distance(self):
+        if self.experiment is None:
             messagebox.showinfo("No Data", "No data loaded to plot")
+            return None
+        try:
+            thresholds = parse_float_list(self.dd_thresholds.get())
+        except ValueError:
+            thresholds = []
+        if not thresholds:
+            messagebox.showwarning("Diffusion Distance", "Enter one or more thresholds, e.g. 50, 10")
+            return None
+        interval = self.interval_map[self.selected_interval.get()]
+        self.last_distance_summary = summarize_diffusion_distances(
+            self.experiment, thresholds, select_time_indices(self.experiment, interval), self.std_ddof.get())
+        return self.last_distance_summary
+
+    @instrumented
+    def plot_diffusion_distance(self):
+        summary = self.compute_diffusion_distance()
+        if summary is None:
+            return
+        self.last_fig = build_diffusion_distance_figure(
+            summary, line_style=self.ts_line_style.get(), marker=self.ts_marker_style.get(),
+            show_std=self.show_std.get(), show_grid=self.ts_show_grid.get(), font_size=self.ts_font_size.get(),
+            cmap=self.data_cmap.get(), fig=self.figure)
+        self.show_figure(self.last_fig)
+
+    def export_diffusion_distance_dialog(self):
+        summary = self.compute_diffusion_distance()
+        if summary is None:
+            return
+        file_path = filedialog.asksaveasfilename(defaultextension=".txt", filetypes=[("Text file", "*.txt")])
+        if not file_path:
             return
+        try:
+            write_diffusion_distance_txt(summary, file_path)
+            messagebox.showinfo("Export", f"Diffusion distances exported as TXT:\n{file_path}")
+        except Exception as e:
+            messagebox.showerror("Export Error", str(e))
 
-        times = sorted(self.time_groups.keys())
-        sources = [np.mean([rep['source'] for rep in self.time_groups[t]]) for t in times]
-        sinks = [np.mean([rep['sink'] for rep in self.time_groups[t]]) for t in times]
+    def compute_diffusion_fit(self, on_done):
+        # Fits in the background and calls on_done(fit) on the Tk thread
+        if self.experiment is None:
+            messagebox.showinfo("No Data", "No data loaded to plot")
+            return
+        if not SCIPY_AVAILABLE:
+            messagebox.showerror("Diffusion Fit", "Fitting requires scipy (pip install scipy)")
+            return
+        exp = self.experiment
+        time_idx = select_time_indices(exp, self.interval_map[self.selected_interval.get()])
 
-        fig, ax = plt.subplots(figsize=(10, 6))
-        ax.plot(times, sources, linestyle=self.ss_line_style.get(), color='blue', label='Source')
-        ax.plot(times, sinks, linestyle=self.ss_line_style.get(), color='red', label='Sink')
-        ax.set_xlabel('Time (hours)', fontsize=self.ss_font_size.get())
-        ax.set_ylabel('Fluorescence (a.u.)', fontsize=self.ss_font_size.get())
-        ax.set_title('Source and Sink Values Over Time', fontsize=self.ss_font_size.get())
-        ax.grid(self.ss_show_grid.get())
-        ax.legend(fontsize=self.ss_font_size.get())
-        self.last_fig = fig
-        plt.show()
+        def fitted(fit):
+            if exp is self.experiment:
+                self.last_fit = fit
+            on_done(fit)
+
+        def fit(progress):
+            with PROFILER.stage('compute_diffusion_fit'):
+                return fit_diffusion(exp, time_idx, progress=progress)
+
+        self.run_task("Fitting D", fit, fitted)
+
+    def plot_diffusion_fit(self):
+        self.compute_diffusion_fit(self.show_diffusion_fit)
+
+    @instrumented
+    def show_diffusion_fit(self, fit):
+        self.last_fig = build_diffusion_fit_figure(
+            fit, marker=self.ts_marker_style.get(), show_grid=self.ts_show_grid.get(),
+            font_size=self.ts_font_size.get(), cmap=self.data_cmap.get(), fig=self.figure)
+        self.show_figure(self.last_fig)
+
+    def export_diffusion_fit_dialog(self):
+        if self.last_fit is None:
+            self.compute_diffusion_fit(self.export_diffusion_fit)
+        else:
+            self.export_diffusion_fit(self.last_fit)
+
+    def export_diffusion_fit(self, fit):
+        file_path = filedialog.asksaveasfilename(defaultextension=".txt", filetypes=[("Text file", "*.txt")])
+        if not file_path:
+            return
+        try:
+            write_diffusion_fit_txt(fit, file_path)
+            messagebox.showinfo("Export", f"Diffusion fit exported as TXT:\n{file_path}")
+        except Exception as e:
+            messagebox.showerror("Export Error", str(e))
 
     def export_plot_dialog(self):
-        filetypes = [("SVG file", "*.svg"), ("Text file", "*.txt")]
+        filetypes = [("SVG file", "*.svg"), ("Text file", "*.txt"), ("NumPy archive", "*.npz")]
+        if PARQUET_AVAILABLE:
+            filetypes.append(("Parquet file", "*.parquet"))
         file_path = filedialog.asksaveasfilename(defaultextension=".txt", filetypes=filetypes)
         if not file_path:
             return
 
         if file_path.endswith('.svg'):
             if hasattr(self, 'last_fig') and self.last_fig:
-                self.last_fig.savefig(file_path, format='svg', bbox_inches='tight')
+                # The on-screen profile plot is decimated; redraw it with every point for publication
+                full = self.profile_plotter is not None and self.full_resolution_export.get()
+                if full:
+                    self.plot_data(full_resolution=True)
+                with PROFILER.stage('export_svg'):
+                    self.last_fig.savefig(file_path, format='svg', bbox_inches='tight')
+                    PROFILER.count(files=1, bytes_written=os.path.getsize(file_path))
+                if full:
+                    self.plot_data()
                 messagebox.showinfo("Export", f"Figure exported as SVG:\n{file_path}")
             else:
                 messagebox.showwarning("Export", "No plot to export.")
         elif file_path.endswith('.txt'):
             self.export_last_data_as_txt(file_path)
+        elif os.path.splitext(file_path)[1] in SUMMARY_WRITERS:
+            try:
+                SUMMARY_WRITERS[os.path.splitext(file_path)[1]](
+                    self.experiment, file_path, summary_table(self.experiment, ddof=self.std_ddof.get()))
+                messagebox.showinfo("Export", f"Data exported:\n{file_path}")
+            except Exception as e:
+                messagebox.showerror("Export Error", str(e))
         else:
             messagebox.showwarning("Export", "Unsupported file extension.")
 
+    @instrumented
     def export_last_data_as_txt(self, file_path):
         try:
-            with open(file_path, 'w') as f:
-                f.write("# Exported Fluorescence Data (Mean ± Std)\n")
-                f.write("# Time(h)\tDistance(um)\tRawMean\tRawStd\tNormMean\tNormStd\n")
-                for t in sorted(self.time_groups.keys()):
-                    group = self.time_groups[t]
-                    # Find all unique distances for this time point across all replicates
-                    all_distances = sorted(set(d for rep in group for d in rep['distance']))
-                    for d in all_distances:
-                        raw_vals = []
-                        norm_vals = []
-                        for rep in group:
-                            if d in rep['distance']:
-                                idx = rep['distance'].index(d)
-                                raw_vals.append(rep['raw'][idx])
-                                norm_vals.append(rep['normalized'][idx])
-                        if raw_vals and norm_vals:
-                            m_r = np.mean(raw_vals)
-                            s_r = np.std(raw_vals, ddof=1) if len(raw_vals) > 1 else 0
-                            m_n = np.mean(norm_vals)
-                            s_n = np.std(norm_vals, ddof=1) if len(norm_vals) > 1 else 0
-                            f.write(f"{t:.2f}\t{d:.1f}\t{m_r:.6f}\t{s_r:.6f}\t{m_n:.6f}\t{s_n:.6f}\n")
+            write_summary_txt(self.experiment, file_path, summary_table(self.experiment, ddof=self.std_ddof.get()))
             messagebox.showinfo("Export", f"Data exported as TXT:\n{file_path}")
         except Exception as e:
             messagebox.showerror("Export Error", str(e))
 
 
 
-if __name__ == "__main__":
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Fluorescence diffusion analyzer. Starts the GUI unless --batch is given.")
+    parser.add_argument('--batch', metavar='DIR',
+                        help="process every folder of .txt replicates under DIR without a display")
+    parser.add_argument('--extract', metavar='DIR',
+                        help="extract line profiles from every chip folder under DIR with TIFF images and a roi.json,"
+                             " writing one .txt per chip to the output directory (runs before --batch)")
+    parser.add_argument('--max-pending', type=int, default=None,
+                        help="frames in flight during --extract (default: twice the worker count)")
+    parser.add_argument('-o', '--output', default='analysis_output', help="output directory for batch results")
+    parser.add_argument('--time-interval', type=float, default=0.25, help="hours between timepoints")
+    parser.add_argument('--pixel-size', type=float, default=POSITION_SPACING_UM,
+                        help="µm between consecutive points along the line")
+    parser.add_argument('--source-sink-window', type=float, metavar='UM',
+                        help="width of the source and sink windows in µm (default: 5 points)")
+    parser.add_argument('--source-sink-estimator', choices=SOURCE_SINK_ESTIMATORS, default='mean',
+                        help="how the source/sink level of each line is taken from its window")
+    parser.add_argument('--normalize-to', choices=NORMALIZATION_SCOPES, default='line',
+                        help="normalize each line to its own source/sink, or to the max source/min sink of the"
+                             " replicate or the whole experiment")
+    parser.add_argument('--distance', type=float, action='append', default=[],
+                        help="also export a time series at this distance in µm (repeatable; several also give a"
+                             " kinetics table)")
+    parser.add_argument('--threshold', type=float, action='append', default=[],
+                        help="also export the diffusion distance at this normalized %% threshold (repeatable)")
+    parser.add_argument('--fit', action='store_true', help="fit erfc profiles and export the diffusion coefficient")
+    parser.add_argument('--format', dest='formats', action='append', choices=sorted(SUMMARY_WRITERS),
+                        help="summary table format, repeatable (default: .txt)")
+    parser.add_argument('--ddof', type=int, choices=(0, 1), default=1,
+                        help="delta degrees of freedom for replicate std (1 = sample, 0 = population)")
+    parser.add_argument('--full-resolution', action='store_true',
+                        help="draw every profile point in the SVGs instead of decimating to the figure width")
+    parser.add_argument('--profile', nargs='?', const='-', metavar='FILE',
+                        help="log per-stage timings and counts as JSON lines to FILE (default: stderr)")
+    parser.add_argument('--profile-memory', action='store_true',
+                        help="with --profile, also record the peak memory of each stage (slower)")
+    parser.add_argument('--cache-dir', help="reuse parsed files from this binary cache directory")
+    parser.add_argument('-j', '--workers', type=int, default=None, help="worker processes (default: all cores)")
+    args = parser.parse_args(argv)
+    if args.profile:
+        PROFILER.configure(True, args.profile_memory, json_lines_sink(None if args.profile == '-' else args.profile))
+
+    status = 0
+    if args.extract:
+        results = extract_chips(find_roi_chip_folders(args.extract), args.output, args.workers, args.max_pending,
+                                root_dir=args.extract)
+        status = 1 if any(isinstance(r, Exception) for r in results.values()) else 0
+        if not args.batch:
+            return status
+
+    if args.batch:
+        results = run_batch(args.batch, args.output, args.time_interval, args.distance, args.threshold,
+                            args.fit, args.formats or ['.txt'], args.workers, args.cache_dir, args.ddof,
+                            args.pixel_size, args.full_resolution, args.profile, args.profile_memory,
+                            {'window_um': args.source_sink_window, 'estimator': args.source_sink_estimator,
+                             'scope': args.normalize_to})
+        return 1 if any(isinstance(r, Exception) for r in results.values()) else status
+
     root = tk.Tk()
-    app = FluorescenceAnalyzer(root)
+    FluorescenceAnalyzer(root)
     root.mainloop()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,191 @@
+"""Regression tests for the numeric kernels behind loading, plotting, lookups and exports."""
+import numpy as np
+import pytest
+
+from diffusion_analysis.data import (NORMALIZATION_SCOPES, SOURCE_SINK_ESTIMATORS, PositionIndex, load_experiment,
+                                     source_sink_levels, stack_profiles)
+from diffusion_analysis.diffusion import threshold_crossings
+from diffusion_analysis.live import LiveExperiment, TextFileSource
+from diffusion_analysis.plotting import decimate_minmax
+from diffusion_analysis.summary import write_summary_txt
+
+
+def write_replicate(path, rows):
+    with open(path, 'w') as f:
+        f.writelines(','.join(f'{v:g}' for v in row) + '\n' for row in rows)
+
+
+def test_threshold_crossings_interpolates_the_first_crossing():
+    distances = np.arange(5) * 10.0
+    profiles = np.array([
+        [100, 80, 40, 20, 0],    # 50 between 10 and 20 µm
+        [100, 40, 60, 40, 0],    # first drop below 50 counts, not the later one
+        [100, 90, 80, 70, 60],   # never crosses
+        [40, 30, 20, 10, 0],     # starts below
+    ], dtype=float)
+    np.testing.assert_allclose(threshold_crossings(profiles, distances, 50.0), [17.5, 25 / 3, np.nan, np.nan])
+
+
+def test_threshold_crossings_broadcasts_over_leading_axes():
+    distances = np.arange(3) * 10.0
+    profiles = np.array([[[100, 50, 0]], [[100, 100, 0]]], dtype=float)
+    result = threshold_crossings(profiles, distances, 75.0)
+    assert result.shape == (2, 1)
+    np.testing.assert_allclose(result[:, 0], [5.0, 12.5])
+
+
+@pytest.mark.parametrize('estimator', SOURCE_SINK_ESTIMATORS)
+def test_source_sink_levels_on_clean_lines(estimator):
+    line = np.concatenate([np.full(10, 1000.0), np.linspace(1000, 100, 20), np.full(10, 100.0)])
+    source, sink = source_sink_levels(line[None, None], 5, estimator)
+    np.testing.assert_allclose(source, 1000.0)
+    np.testing.assert_allclose(sink, 100.0)
+
+
+@pytest.mark.parametrize('estimator, rejects_outlier', [('mean', False), ('median', True), ('trimmed', True),
+                                                        ('plateau', True)])
+def test_source_sink_levels_with_a_hot_pixel(estimator, rejects_outlier):
+    line = np.concatenate([np.full(20, 1000.0), np.full(20, 100.0)])
+    line[2] = 60000.0
+    source, sink = source_sink_levels(line[None], 5, estimator)
+    assert np.isclose(source[0], 1000.0) == rejects_outlier
+    assert np.isclose(sink[0], 100.0)
+
+
+def test_source_sink_levels_use_the_last_valid_points_of_ragged_lines():
+    raw = stack_profiles([np.array([[1, 1, 1, 5, 5, 5]], dtype=float), np.array([[2, 2, 9, 9]], dtype=float)])
+    for estimator in SOURCE_SINK_ESTIMATORS:
+        source, sink = source_sink_levels(raw, 2, estimator)
+        np.testing.assert_allclose(source[:, 0], [1, 2])
+        np.testing.assert_allclose(sink[:, 0], [5, 9])
+
+
+def test_plateau_runs_past_the_window():
+    line = np.concatenate([np.full(30, 1000.0), np.full(30, 100.0)])
+    line[10:30] = 1020.0  # the plateau beyond the 5-point window sits slightly higher
+    source, _ = source_sink_levels(line[None], 5, 'plateau')
+    np.testing.assert_allclose(source, (10 * 1000 + 20 * 1020) / 30)
+
+
+def test_source_sink_levels_rejects_unknown_estimators():
+    with pytest.raises(ValueError):
+        source_sink_levels(np.ones((1, 10)), 5, 'mode')
+
+
+def test_position_index_sample_on_and_off_grid():
+    index = PositionIndex(np.arange(5) * 10.0)
+    values = np.array([[0.0, 10.0, np.nan, 30.0, 40.0]])
+    query = [0.0, 5.0, 10.0, 15.0, 30.0, 35.0, 40.0, -1.0, 41.0]
+    expected = [0.0, 5.0, 10.0, np.nan, 30.0, 35.0, 40.0, np.nan, np.nan]
+    # Grid hits next to a NaN keep their own value; points between a NaN neighbour are NaN
+    np.testing.assert_allclose(index.sample(values, query)[0], expected)
+
+
+def test_position_index_sample_nearest_with_tolerance():
+    index = PositionIndex(np.arange(5) * 10.0)
+    values = np.arange(5.0)[None] * 2
+    np.testing.assert_allclose(index.sample(values, [4.0, 6.0, 24.0, 26.0], interpolate=False)[0], [0, 2, 4, 6])
+    np.testing.assert_allclose(index.sample(values, [2.0, 4.0, 50.0], interpolate=False, tolerance=3)[0],
+                               [0, np.nan, np.nan])
+
+
+def test_decimate_minmax_keeps_each_bucket_extremes_in_x_order():
+    x = np.arange(12.0)
+    ys = np.array([[0, 5, 1, 1, -3, 1, 2, 2, 2, 9, 0, 1]], dtype=float)
+    xs, dec = decimate_minmax(x, ys, 3)
+    np.testing.assert_array_equal(xs, [[0, 1, 4, 6, 9, 10]])
+    np.testing.assert_array_equal(dec, [[0, 5, -3, 2, 9, 0]])
+
+
+def test_decimate_minmax_skips_nan_padding_and_short_rows():
+    x = np.arange(10.0)
+    ys = np.vstack([np.arange(10.0), np.r_[np.arange(6.0), [np.nan] * 4]])
+    xs, dec = decimate_minmax(x, ys, 2)
+    np.testing.assert_array_equal(dec[0], [0, 4, 5, 9])
+    np.testing.assert_array_equal(dec[1, :2], [0, 4])
+    assert not np.isnan(dec[1, 2])
+    short_x, short = decimate_minmax(x, ys, 5)
+    np.testing.assert_array_equal(short, ys)
+
+
+@pytest.fixture
+def ragged_replicates(tmp_path):
+    # Three replicates with different numbers of timepoints and positions
+    rng = np.random.default_rng(1)
+    shapes = [(6, 40), (4, 40), (6, 35)]
+    data = []
+    for n_times, n_positions in shapes:
+        x = np.linspace(0, 1, n_positions)
+        front = np.linspace(0.1, 0.5, n_times)[:, None]
+        data.append(np.round(1000 / (1 + np.exp((x - front) / 0.05)) + 100 + rng.normal(0, 5, (n_times, n_positions))))
+    paths = [str(tmp_path / f'rep_{r}.txt') for r in range(len(data))]
+    for path, rows in zip(paths, data):
+        write_replicate(path, rows)
+    return paths, data
+
+
+@pytest.mark.parametrize('scope', NORMALIZATION_SCOPES)
+def test_live_polling_matches_loading_the_finished_files(tmp_path, ragged_replicates, scope):
+    paths, data = ragged_replicates
+    live_paths = [str(tmp_path / f'live_{r}.txt') for r in range(len(data))]
+    for path in live_paths:
+        open(path, 'w').close()
+    live = LiveExperiment([TextFileSource(p) for p in live_paths], capacity=2, normalization={'scope': scope})
+    live.stats(1)
+    for t in range(6):
+        for path, rows in zip(live_paths, data):
+            if t < len(rows):
+                with open(path, 'a') as f:
+                    f.write(','.join(f'{v:g}' for v in rows[t]) + '\n')
+        live.poll()
+    batch = load_experiment(paths, normalization={'scope': scope})
+    for name in ('raw', 'normalized', 'source', 'sink'):
+        np.testing.assert_allclose(getattr(live, name), getattr(batch, name), equal_nan=True)
+    for name in ('raw', 'normalized'):
+        for key in ('mean', 'std', 'n'):
+            np.testing.assert_allclose(getattr(live.stats(1), name)[key], getattr(batch.stats(1), name)[key],
+                                       equal_nan=True)
+
+
+def test_text_source_reports_a_malformed_line_once_then_skips_it(tmp_path):
+    path = tmp_path / 'live.txt'
+    path.write_text('1,2,3\n4,x,6\n7,8,9\n10,11')
+    source = TextFileSource(str(path))
+    np.testing.assert_array_equal(source.poll(), [[1, 2, 3]])
+    with pytest.raises(ValueError, match='live.txt'):
+        source.poll()
+    rows = source.poll()
+    np.testing.assert_array_equal(rows, [[np.nan] * 3, [7, 8, 9]])
+    assert source.poll() == []  # the unterminated last line waits
+    with open(path, 'a') as f:
+        f.write(',12\n')
+    np.testing.assert_array_equal(source.poll(), [[10, 11, 12]])
+
+
+def reference_summary_txt(data, file_path, time_interval=0.25, spacing=10.0):
+    # Per-line normalization and per-distance mean ± std, as the exporter worked before the array code
+    groups = {}
+    for rows in data:
+        for ti, values in enumerate(rows):
+            source, sink = np.mean(values[:5]), np.mean(values[-5:])
+            groups.setdefault(ti, []).append((values, (values - sink) / (source - sink) * 100))
+    with open(file_path, 'w') as f:
+        f.write("# Exported Fluorescence Data (Mean ± Std)\n")
+        f.write("# Time(h)\tDistance(um)\tRawMean\tRawStd\tNormMean\tNormStd\n")
+        for ti in sorted(groups):
+            for i in range(max(len(raw) for raw, _ in groups[ti])):
+                raw = [r[i] for r, _ in groups[ti] if i < len(r)]
+                norm = [n[i] for r, n in groups[ti] if i < len(r)]
+                s_r = np.std(raw, ddof=1) if len(raw) > 1 else 0
+                s_n = np.std(norm, ddof=1) if len(norm) > 1 else 0
+                f.write(f"{ti * time_interval:.2f}\t{i * spacing:.1f}\t{np.mean(raw):.6f}\t{s_r:.6f}\t"
+                        f"{np.mean(norm):.6f}\t{s_n:.6f}\n")
+
+
+def test_summary_txt_matches_the_per_line_exporter_on_ragged_replicates(tmp_path, ragged_replicates):
+    paths, data = ragged_replicates
+    reference = tmp_path / 'reference.txt'
+    exported = tmp_path / 'exported.txt'
+    reference_summary_txt(data, reference)
+    write_summary_txt(load_experiment(paths), exported)
+    assert exported.read_bytes() == reference.read_bytes()
@@ -0,0 +1,192 @@
+"""Tests for the parse cache, the D fit, TIFF extraction, the experiment store and batch processing."""
+import glob
+import json
+import os
+
+import numpy as np
+import pytest
+
+from diffusion_analysis.batch import run_batch
+from diffusion_analysis.data import ExperimentData, ProfileCache, load_experiment
+from diffusion_analysis.diffusion import fit_diffusion
+from diffusion_analysis.store import ExperimentStore, parse_experiment_name
+from diffusion_analysis.summary import write_summary_txt
+from diffusion_analysis.tiff import (MANIFEST_FILENAME, ROI_FILENAME, extract_chips, find_roi_chip_folders,
+                                     recorded_spacings, save_line_roi)
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def write_replicate(path, rows):
+    with open(path, 'w') as f:
+        f.writelines(','.join(f'{v:g}' for v in row) + '\n' for row in rows)
+
+
+def touch_later(path, seconds=1):
+    # A distinct mtime even on file systems with coarse timestamps
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + seconds * 10**9))
+
+
+def test_profile_cache_follows_mtime_and_content_changes(tmp_path):
+    cache = ProfileCache(str(tmp_path / 'cache'))
+    path = str(tmp_path / 'rep.txt')
+    write_replicate(path, [[1, 2, 3], [4, 5, 6]])
+    np.testing.assert_array_equal(cache.load(path), [[1, 2, 3], [4, 5, 6]])
+    assert isinstance(cache.load(path), np.memmap)
+
+    # Same content under a new mtime: a new stat entry pointing at the same array
+    touch_later(path)
+    np.testing.assert_array_equal(cache.load(path), [[1, 2, 3], [4, 5, 6]])
+    assert len(os.listdir(cache.stat_dir)) == 2
+    assert len(os.listdir(cache.data_dir)) == 1
+
+    write_replicate(path, [[7, 8, 9]])
+    touch_later(path, 2)
+    np.testing.assert_array_equal(cache.load(path), [[7, 8, 9]])
+    assert len(os.listdir(cache.data_dir)) == 2
+
+
+def test_profile_cache_evicts_the_least_recently_used_array(tmp_path):
+    paths = [str(tmp_path / f'rep_{i}.txt') for i in range(3)]
+    for i, path in enumerate(paths):
+        write_replicate(path, np.full((4, 10), i))
+    cache = ProfileCache(str(tmp_path / 'cache'))
+    for path in paths[:2]:
+        cache.load(path)
+    entry_bytes = cache.size() // 2
+    cache.max_bytes = 2 * entry_bytes
+
+    # Age both arrays, then use the first again so the second is the least recently used
+    for age, path in zip((2000, 1000), paths[:2]):
+        data_path = os.path.join(cache.data_dir, ProfileCache._content_hash(path) + '.npy')
+        os.utime(data_path, (os.stat(data_path).st_atime - age, os.stat(data_path).st_mtime - age))
+    cache.load(paths[0])
+    cache.load(paths[2])
+    cached = {name[:-4] for name in os.listdir(cache.data_dir)}
+    assert cached == {ProfileCache._content_hash(paths[i]) for i in (0, 2)}
+    assert cache.size() <= cache.max_bytes
+    assert len(os.listdir(cache.stat_dir)) == 2  # the evicted array's stat entry goes with it
+    np.testing.assert_array_equal(cache.load(paths[1]), np.ones((4, 10)))
+
+
+def erfc_profiles(diffusion, n_times=21, n_positions=300, interface=30, partition=0.4, seed=0):
+    # A constant source at x <= interface feeding a gel that takes up partition times its concentration
+    from scipy.special import erfc
+
+    rng = np.random.default_rng(seed)
+    x = np.arange(n_positions) * 10.0
+    t = np.maximum(np.arange(n_times) * 0.25 * 3600, 1e-9)[:, None]
+    gel = partition * erfc((x - x[interface]) / (2 * np.sqrt(diffusion * t)))
+    return np.round(1000 * np.where(x <= x[interface], 1.0, gel) + 100 + rng.normal(0, 5, (n_times, n_positions)))
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_fit_diffusion_recovers_d_of_synthetic_erfc_profiles(workers):
+    pytest.importorskip('scipy')
+    # The front reaches a quarter of the gel by the last timepoint, so the profiles stay semi-infinite
+    diffusion = (270 * 10.0 / 4) ** 2 / (4 * 5 * 3600)
+    exp = ExperimentData(np.stack([erfc_profiles(diffusion, seed=r) for r in range(3)]), 0.25)
+    result = fit_diffusion(exp, workers=workers)
+    assert abs(result['D'] - diffusion) < 0.05 * diffusion
+    np.testing.assert_allclose(result['D_replicate'], diffusion, rtol=0.1)
+    assert result['D_ci'][0] < result['D'] < result['D_ci'][1]
+
+
+def write_chip(folder, n_frames, stack=False, offset=0):
+    """Timepoint TIFFs plus a brightfield and a horizontal line ROI; returns the expected profiles."""
+    tifffile = pytest.importorskip('tifffile')
+    os.makedirs(folder, exist_ok=True)
+    rows, cols = np.mgrid[:16, :24]
+    frames = [(cols * 10 + rows + 100 * t + offset).astype(np.uint16) for t in range(n_frames)]
+    tifffile.imwrite(os.path.join(folder, 'brightfield.tif'), np.zeros((16, 24), np.uint16))
+    if stack:
+        tifffile.imwrite(os.path.join(folder, 'stack.tif'), np.stack(frames), photometric='minisblack')
+    else:
+        for t, frame in enumerate(frames):
+            tifffile.imwrite(os.path.join(folder, f't{t + 1}.tif'), frame)
+    save_line_roi(os.path.join(folder, ROI_FILENAME), (2, 5), (12, 5), n_points=11, um_per_pixel=0.5)
+    return np.array([frame[5, 2:13] for frame in frames], dtype=float)
+
+
+def test_extract_chips_layout_manifest_and_resume(tmp_path):
+    root = tmp_path / 'campaign'
+    out = str(tmp_path / 'extracted')
+    expected = {'chip 5.1': write_chip(str(root / 'exp1' / 'chip 5.1'), 3),
+                'chip 5.2': write_chip(str(root / 'exp1' / 'chip 5.2'), 4, stack=True)}
+    empty = str(root / 'exp1' / 'chip 5.3')
+    write_chip(empty, 0)  # a brightfield only
+    folders = find_roi_chip_folders(str(root))
+    logs = []
+    results = extract_chips(folders, out, workers=1, root_dir=str(root), log=logs.append)
+
+    assert isinstance(results.pop(os.path.abspath(empty)), ValueError)
+    assert any(message.startswith(f"{empty}: failed") for message in logs)
+    for name, profiles in expected.items():
+        output = os.path.join(out, 'exp1', name + '.txt')
+        assert results[os.path.abspath(root / 'exp1' / name)]['output'] == output
+        np.testing.assert_allclose(np.loadtxt(output, delimiter=',', ndmin=2), profiles)
+    extracted = sorted(glob.glob(os.path.join(out, 'exp1', '*.txt')))
+    assert recorded_spacings(extracted) == [0.5, 0.5]
+    with open(os.path.join(out, MANIFEST_FILENAME)) as f:
+        assert set(json.load(f)) == set(results)
+
+    # A second run skips the finished chips and retries the failed one
+    logs.clear()
+    results = extract_chips(folders, out, workers=1, root_dir=str(root), log=logs.append)
+    assert list(results) == [os.path.abspath(empty)]
+    assert sum('already extracted' in message for message in logs) == 2
+
+    # A changed image brings its chip back
+    changed = write_chip(str(root / 'exp1' / 'chip 5.1'), 3, offset=7)
+    touch_later(str(root / 'exp1' / 'chip 5.1' / 't2.tif'))
+    results = extract_chips(folders[:2], out, workers=1, root_dir=str(root), log=logs.append)
+    assert list(results) == [os.path.abspath(root / 'exp1' / 'chip 5.1')]
+    np.testing.assert_allclose(np.loadtxt(os.path.join(out, 'exp1', 'chip 5.1.txt'), delimiter=','), changed)
+
+
+def test_parse_experiment_name_in_any_token_order():
+    assert parse_experiment_name('20250403_chip 5.1_50-50_4kDa_10h_FITC.txt') == {
+        'date': '20250403', 'chip': '5', 'replicate': '1', 'ratio': '50-50', 'kda': 4.0, 'duration_h': 10.0,
+        'dye': 'FITC'}
+    meta = parse_experiment_name('/data/FITC_12.5h_chip3_70-30.txt')
+    assert (meta['chip'], meta['replicate'], meta['duration_h'], meta['ratio'], meta['dye']) == (
+        '3', None, 12.5, '70-30', 'FITC')
+    # A single word would pass for a dye, so plain names carry no metadata
+    assert not any(parse_experiment_name('rep_1.txt').values())
+
+
+def test_experiment_store_groups_replicates_by_condition(tmp_path):
+    layout = {
+        'a': ['20250403_chip 5.1_50-50_4kDa_10h_FITC.txt', '20250403_chip 5.2_50-50_4kDa_10h_FITC.txt',
+              '20250403_chip 6.1_50-50_10kDa_10h_FITC.txt'],
+        'b': ['rep_1.txt', 'rep_2.txt'],
+        'c': ['20250403_chip 5.1_50-50_4kDa_10h_FITC.txt'],
+    }
+    for directory, names in layout.items():
+        os.makedirs(tmp_path / directory)
+        for name in names:
+            write_replicate(tmp_path / directory / name, [[3, 2, 1], [4, 3, 2]])
+    store = ExperimentStore()
+    keys = store.add_folder(str(tmp_path))
+    label = '20250403 chip 5 50-50 4kDa 10h FITC'
+    assert keys == [label, '20250403 chip 6 50-50 10kDa 10h FITC', 'chip b', f'{label} [c]']
+    assert [os.path.basename(p) for p in store.entries[label]['files']] == layout['a'][:2]
+    assert len(store.entries['chip b']['files']) == 2
+    assert store.load(label).raw.shape == (2, 2, 3)
+
+
+def test_run_batch_on_the_example_chip(tmp_path):
+    chip_dir = os.path.join(REPO_DIR, 'chip5')
+    logs = []
+    results = run_batch(chip_dir, str(tmp_path), distances=(500, 1000), thresholds=(50,), workers=1,
+                        log=logs.append)
+    assert logs == ['chip5: wrote 9 files']
+    assert sorted(os.path.basename(p) for p in results['chip5']) == sorted(
+        'chip5' + suffix for suffix in ('_summary.txt', '_kinetics.txt', '_diffusion_distance.txt', '_profiles.svg',
+                                        '_source_sink.svg', '_time_series_500um.svg', '_time_series_1000um.svg',
+                                        '_kinetics.svg', '_diffusion_distance.svg'))
+    assert all(os.path.getsize(p) for p in results['chip5'])
+    reference = tmp_path / 'reference.txt'
+    write_summary_txt(load_experiment(sorted(glob.glob(os.path.join(chip_dir, '*.txt')))), reference)
+    assert (tmp_path / 'chip5_summary.txt').read_bytes() == reference.read_bytes()